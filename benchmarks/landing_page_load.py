@@ -0,0 +1,95 @@
+"""
+requests per second for the dashboard endpoints, against the app served by uvicorn
+in its own process the way main.py runs it.
+
+run from the repository root: python -m benchmarks.landing_page_load
+"""
+
+import asyncio
+import socket
+import subprocess
+import sys
+import time
+from typing import Optional
+
+import aiohttp
+
+_PORT = 8765
+_CONCURRENCY = 20
+_DURATION = 5.0  # seconds per endpoint
+
+
+async def _worker(
+    session: aiohttp.ClientSession, url: str, headers: dict, deadline: float
+) -> int:
+    done = 0
+    while time.perf_counter() < deadline:
+        async with session.get(url, headers=headers) as response:
+            await response.read()
+            assert response.status in (200, 304), response.status
+        done += 1
+    return done
+
+
+async def _load(url: str, headers: dict) -> float:
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url, headers=headers) as response:  # warm up
+            await response.read()
+        started = time.perf_counter()
+        deadline = started + _DURATION
+        counts = await asyncio.gather(
+            *(_worker(session, url, headers, deadline) for _ in range(_CONCURRENCY))
+        )
+        return sum(counts) / (time.perf_counter() - started)
+
+
+async def _etag(url: str) -> Optional[str]:
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as response:
+            return response.headers.get("ETag")
+
+
+def _wait_for_server(timeout: float = 20.0):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", _PORT), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError("server did not start")
+
+
+def main():
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "main:app",
+            "--port",
+            str(_PORT),
+            "--log-level",
+            "warning",
+        ]
+    )
+    try:
+        _wait_for_server()
+        base = f"http://127.0.0.1:{_PORT}"
+        etag = asyncio.run(_etag(f"{base}/"))
+        for name, url, headers in (
+            ("/", f"{base}/", {}),
+            ("/ (If-None-Match)", f"{base}/", {"If-None-Match": etag}),
+            ("/get_status", f"{base}/get_status", {}),
+        ):
+            if None in headers.values():  # a server without etags, to compare with
+                continue
+            rate = asyncio.run(_load(url, headers))
+            print(f"{name:<20} {rate:8.0f} requests/second")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+event loop lag while scanning 18 dates, parsing inline on the loop vs in the parse pool.
+a ticker standing in for the booking tasks sleeps 1ms at a time and records how late it wakes up.
+
+run from the repository root: python -m benchmarks.parse_pool_loop_lag
+"""
+
+import asyncio
+import logging
+import statistics
+import time
+
+from parse_pool import ParsePool
+from visual_theater import _parse_rooms
+from visual_theater_test import _MY_RESPONSE
+
+_DATES = 18
+_NETWORK_LATENCY = 0.05  # seconds, every page fetch waits this long
+_TICK = 0.001
+
+logger = logging.getLogger(__name__)
+
+
+async def _ticker(lags: list[float], stop: asyncio.Event):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + _TICK
+        await asyncio.sleep(_TICK)
+        lags.append(loop.time() - expected)
+
+
+async def _fetch_and_parse_inline(html: str):
+    await asyncio.sleep(_NETWORK_LATENCY)
+    return list(_parse_rooms(html, logger))
+
+
+async def _fetch_and_parse_in_pool(pool: ParsePool, html: str):
+    await asyncio.sleep(_NETWORK_LATENCY)
+    return await pool.parse_rooms(html, logger)
+
+
+async def _measure(scan) -> tuple[float, list[float]]:
+    lags = []
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(_ticker(lags, stop))
+    started = time.perf_counter()
+    await scan()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await ticker
+    return elapsed, lags
+
+
+def _report(name: str, elapsed: float, lags: list[float]):
+    lags_ms = sorted(lag * 1000 for lag in lags)
+    p99 = lags_ms[int(len(lags_ms) * 0.99) - 1]
+    print(
+        f"{name:<8} scan {elapsed * 1000:7.1f}ms  "
+        f"lag median {statistics.median(lags_ms):6.2f}ms  "
+        f"p99 {p99:6.2f}ms  max {lags_ms[-1]:6.2f}ms"
+    )
+
+
+def main():
+    pool = ParsePool()
+    started = time.perf_counter()
+    pool.start()
+    print(
+        f"pool of {pool.workers} workers started in {time.perf_counter() - started:.2f}s"
+    )
+    try:
+
+        async def inline():
+            await asyncio.gather(
+                *(_fetch_and_parse_inline(_MY_RESPONSE) for _ in range(_DATES))
+            )
+
+        async def pooled():
+            await asyncio.gather(
+                *(_fetch_and_parse_in_pool(pool, _MY_RESPONSE) for _ in range(_DATES))
+            )
+
+        _report("inline", *asyncio.run(_measure(inline)))
+        _report("pool", *asyncio.run(_measure(pooled)))
+    finally:
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+send time jitter and client cpu per burst attempt: aiohttp with a session per attempt
+(the shared transport), aiohttp pooled per path (the dispatcher) and the raw sender.
+a stand-in site in its own process answers every booking with a page the size of the real
+one and notes when each request arrived, so lateness is measured where it matters.
+
+run from the repository root: python -m benchmarks.raw_sender_jitter
+"""
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import statistics
+import time
+from datetime import datetime
+
+from aiohttp import web
+
+from dispatch import HedgedDispatcher, NetworkPath
+from http_transport import LiveTransport
+from models import FormToken, SessionCookie, SessionCredentials
+from raw_sender import RawSender
+from site_profile import SiteProfileConfig, _DEFAULT_PROFILE_PATH, compile_profile
+from visual_theater import book_room
+
+_ATTEMPTS = 40
+_INTERVAL = 0.1  # seconds, the burst's pace
+# two blocks of ~30KB around the message, about the size of a real page
+_FILLER = "<div class='region'><p>" + "תוכן " * 6000 + "</p></div>"
+_BOOKED_PAGE = (
+    f"<html><body>{_FILLER}"
+    '<div class="alert alert-dismissible"><div>הזמנה של my-user נוצר.</div></div>'
+    f"{_FILLER}</body></html>"
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _serve(port_queue: multiprocessing.Queue):
+    arrivals = []
+
+    async def book(request: web.Request) -> web.Response:
+        arrivals.append(time.time())
+        await request.post()
+        return web.Response(text=_BOOKED_PAGE, content_type="text/html")
+
+    async def stats(request: web.Request) -> web.Response:
+        response = web.json_response(arrivals[:])
+        arrivals.clear()
+        return response
+
+    async def main():
+        app = web.Application()
+        app.router.add_get("/stats", stats)
+        app.router.add_post("/{tail:.*}", book)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 0).start()
+        port_queue.put(runner.addresses[0][1])
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+async def _arrivals(base_url: str) -> list[float]:
+    transport = LiveTransport()
+    response = await asyncio.to_thread(transport.get, f"{base_url}/stats", {}, {})
+    return json.loads(response.text)
+
+
+async def _run(sender, profile, creds) -> tuple[list[float], float]:
+    """
+    the burst's schedule, returns the scheduled send times and cpu seconds per attempt
+    """
+    tasks, scheduled = [], []
+    cpu_started = time.process_time()
+    started = time.time() + 0.05
+    for attempt in range(_ATTEMPTS):
+        send_at = started + attempt * _INTERVAL
+        await asyncio.sleep(send_at - time.time())
+        scheduled.append(send_at)
+        tasks.append(
+            asyncio.create_task(
+                book_room(
+                    creds,
+                    datetime(2024, 5, 26, 8, 0),
+                    "14343",
+                    logger,
+                    profile,
+                    sender=sender,
+                )
+            )
+        )
+    assert all(await asyncio.gather(*tasks))
+    return scheduled, (time.process_time() - cpu_started) / _ATTEMPTS
+
+
+def _report(name: str, scheduled: list[float], arrivals: list[float], cpu: float):
+    late_ms = sorted((a - s) * 1000 for s, a in zip(scheduled, sorted(arrivals)))
+    p99 = late_ms[int(len(late_ms) * 0.99) - 1]
+    print(
+        f"{name:<8} lateness median {statistics.median(late_ms):6.2f}ms  "
+        f"p99 {p99:6.2f}ms  max {late_ms[-1]:6.2f}ms  "
+        f"stdev {statistics.stdev(late_ms):5.2f}ms  cpu/attempt {cpu * 1000:5.2f}ms"
+    )
+
+
+async def _benchmark(port: int):
+    base_url = f"http://127.0.0.1:{port}"
+    config = SiteProfileConfig.model_validate_json(
+        _DEFAULT_PROFILE_PATH.read_text(encoding="utf-8")
+    )
+    profile = compile_profile(config.model_copy(update={"base_url": base_url}))
+    creds = SessionCredentials(
+        cookie=SessionCookie({"SESS1": "id"}),
+        form_token=FormToken("token"),
+        account="my-account",
+    )
+    await _arrivals(base_url)  # warms up the clients
+
+    scheduled, cpu = await _run(LiveTransport(), profile, creds)
+    _report("aiohttp", scheduled, await _arrivals(base_url), cpu)
+
+    path = NetworkPath(address="127.0.0.1", port=port, rtt=0.001)
+    async with HedgedDispatcher([path], min_budget=5) as dispatcher:
+        scheduled, cpu = await _run(dispatcher, profile, creds)
+    _report("pooled", scheduled, await _arrivals(base_url), cpu)
+
+    async with RawSender(base_url, profile) as sender:
+        scheduled, cpu = await _run(sender, profile, creds)
+    _report("raw", scheduled, await _arrivals(base_url), cpu)
+
+
+def main():
+    context = multiprocessing.get_context("spawn")
+    port_queue = context.Queue()
+    server = context.Process(target=_serve, args=(port_queue,), daemon=True)
+    server.start()
+    try:
+        asyncio.run(_benchmark(port_queue.get(timeout=30)))
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
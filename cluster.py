@@ -0,0 +1,436 @@
+import asyncio
+import dataclasses
+import hmac
+import ipaddress
+import logging
+import os
+import ssl
+import time
+import urllib.parse
+from datetime import datetime, timedelta
+from typing import Optional
+
+import aiohttp
+from aiohttp import web
+
+from models import Credentials, ScheduleRoomCommand, SessionCredentials
+from site_profile import SiteProfile, active_profile
+from visual_theater import book_room, query_session_creds
+
+# shared secret, agents refuse commands without it when set.
+# an agent reachable from other machines must have one
+_TOKEN_ENV = "CLUSTER_TOKEN"
+_TOKEN_HEADER = "x-cluster-token"
+_CLOCK_SAMPLES = 5
+_CLOCK_TIMEOUT = 5  # seconds per clock sample, a slower agent is left out of the race
+_BURST_ATTEMPTS = 30  # for the whole cluster, as many as a single node sends
+_ATTEMPT_INTERVAL = 0.1  # seconds between two attempts of the cluster
+_RACE_TIMEOUT_MARGIN = 60  # seconds an agent may take past the end of its burst
+
+
+@dataclasses.dataclass
+class AgentResult:
+    agent: str
+    success: bool
+    attempts: int
+    error: Optional[str] = None
+
+
+def _headers(token: Optional[str]) -> dict[str, str]:
+    return {_TOKEN_HEADER: token} if token else {}
+
+
+def _is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def _check_agent_urls(agents: list[str], trusted_network: bool):
+    """
+    races carry a session and the token, only a loopback agent or one on a trusted network
+    is sent them in the clear, any other must be https
+    """
+    for agent in agents:
+        parts = urllib.parse.urlsplit(agent)
+        if parts.scheme == "https" or trusted_network:
+            continue
+        if not _is_loopback(parts.hostname or ""):
+            raise ValueError(
+                f"agent {agent} is not https and the network is not trusted"
+            )
+
+
+# agent
+
+
+async def _run_share(
+    race: dict, stop: asyncio.Event, logger: logging.Logger, profile: SiteProfile
+) -> tuple[bool, int]:
+    """
+    the agent's share of the burst: every agents-th attempt, starting at its index.
+    fire_at is already on this agent's clock
+    """
+    meeting_time = datetime.fromisoformat(race["meeting_time"])
+    if race["session"] is not None:
+        creds = SessionCredentials.model_validate(race["session"])
+    else:  # passwords never leave their machine, the agent has its own in its env
+        creds = await asyncio.to_thread(query_session_creds, Credentials(), profile)
+    agents, index, interval = race["agents"], race["index"], race["interval"]
+    tasks = []
+
+    def on_result(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is None and task.result():
+            stop.set()
+
+    for attempt in range(index, race["attempts"], agents):
+        delay = race["fire_at"] + attempt * interval - time.time()
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=max(delay, 0))
+            break  # stopped while waiting
+        except asyncio.TimeoutError:
+            pass
+        task = asyncio.create_task(
+            book_room(creds, meeting_time, race["room"], logger, profile)
+        )
+        task.add_done_callback(on_result)
+        tasks.append(task)
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error(f"AgentBookingFailed: {result}")
+    return any(result is True for result in results), len(tasks)
+
+
+def agent_app(name: str, logger: logging.Logger) -> web.Application:
+    """
+    /clock: the agent's clock, for the coordinator to estimate the offset
+    /race: runs the agent's share of a burst, answers when it is over (long poll)
+    /stop: ends a running race early, another agent won it
+    """
+    token = os.environ.get(_TOKEN_ENV)
+    races: dict[str, asyncio.Event] = {}
+
+    @web.middleware
+    async def authorize(request: web.Request, handler):
+        if token and not hmac.compare_digest(
+            request.headers.get(_TOKEN_HEADER, "").encode(), token.encode()
+        ):
+            raise web.HTTPUnauthorized()
+        return await handler(request)
+
+    async def clock(request: web.Request) -> web.Response:
+        return web.json_response({"time": time.time()})
+
+    async def run_race(request: web.Request) -> web.Response:
+        race = await request.json()
+        profile = active_profile()
+        if race["profile"] != profile.name:
+            raise web.HTTPConflict(text=f"agent runs profile {profile.name}")
+        stop = races.setdefault(race["race_id"], asyncio.Event())
+        logger.info(f"AgentRaceStarted: {race['race_id']} {race['index']}")
+        try:
+            success, attempts = await _run_share(race, stop, logger, profile)
+            result = AgentResult(agent=name, success=success, attempts=attempts)
+        except Exception as e:
+            logger.error(f"AgentRaceFailed: {e}")
+            result = AgentResult(agent=name, success=False, attempts=0, error=str(e))
+        finally:
+            races.pop(race["race_id"], None)
+        logger.info(f"AgentRaceEnded: {result}")
+        return web.json_response(dataclasses.asdict(result))
+
+    async def stop_race(request: web.Request) -> web.Response:
+        race_id = (await request.json())["race_id"]
+        # a stop arriving before its race still ends it
+        races.setdefault(race_id, asyncio.Event()).set()
+        return web.json_response({})
+
+    app = web.Application(middlewares=[authorize])
+    app.router.add_get("/clock", clock)
+    app.router.add_post("/race", run_race)
+    app.router.add_post("/stop", stop_race)
+    return app
+
+
+# coordinator
+
+
+async def _clock_offset(
+    session: aiohttp.ClientSession, agent: str, token: Optional[str]
+) -> float:
+    """
+    ntp style: the agent read its clock halfway through the round trip,
+    the sample with the shortest round trip is the most accurate
+    """
+    samples = []
+    for _ in range(_CLOCK_SAMPLES):
+        sent = time.time()
+        async with session.get(
+            f"{agent}/clock",
+            headers=_headers(token),
+            timeout=aiohttp.ClientTimeout(total=_CLOCK_TIMEOUT),
+        ) as response:
+            response.raise_for_status()
+            agent_time = (await response.json())["time"]
+        received = time.time()
+        samples.append((received - sent, agent_time - (sent + received) / 2))
+    return min(samples)[1]
+
+
+async def _race_agent(
+    session: aiohttp.ClientSession,
+    agent: str,
+    race: dict,
+    offset: float,
+    token: Optional[str],
+) -> AgentResult:
+    timeout = aiohttp.ClientTimeout(
+        total=race["fire_at"] - time.time() + _RACE_TIMEOUT_MARGIN
+    )
+    race = {**race, "fire_at": race["fire_at"] + offset}  # on the agent's clock
+    try:
+        async with session.post(
+            f"{agent}/race", json=race, headers=_headers(token), timeout=timeout
+        ) as response:
+            response.raise_for_status()
+            return AgentResult(**await response.json())
+    except Exception as e:
+        return AgentResult(agent=agent, success=False, attempts=0, error=repr(e))
+
+
+async def _stop_agents(
+    session: aiohttp.ClientSession,
+    agents: list[str],
+    race_id: str,
+    token: Optional[str],
+    logger: logging.Logger,
+):
+    async def stop(agent: str):
+        try:
+            async with session.post(
+                f"{agent}/stop", json={"race_id": race_id}, headers=_headers(token)
+            ):
+                pass
+        except Exception as e:
+            logger.error(f"AgentStopFailed: {agent} {e}")
+
+    await asyncio.gather(*(stop(agent) for agent in agents))
+
+
+async def race(
+    agents: list[str],
+    meeting: ScheduleRoomCommand,
+    fire_at: float,
+    logger: logging.Logger,
+    session_credentials: Optional[SessionCredentials] = None,
+    profile: Optional[SiteProfile] = None,
+    attempts: int = _BURST_ATTEMPTS,
+    interval: float = _ATTEMPT_INTERVAL,
+    trusted_network: bool = False,
+    tls: Optional[ssl.SSLContext] = None,
+) -> list[AgentResult]:
+    """
+    runs one burst over every agent, fire_at on the coordinator's clock.
+    with session credentials the agents share that session,
+    without them every agent logs in on its own with the credentials in its env.
+    the first success stops the other agents.
+    agents are https unless on loopback or a trusted network, tls verifies them
+    """
+    _check_agent_urls(agents, trusted_network)
+    profile = profile or active_profile()
+    token = os.environ.get(_TOKEN_ENV)
+    race_id = f"{meeting.room}-{fire_at}"
+    shared = {
+        "race_id": race_id,
+        "profile": profile.name,
+        "meeting_time": meeting.time.isoformat(),
+        "room": meeting.room,
+        "session": (session_credentials.model_dump() if session_credentials else None),
+        "fire_at": fire_at,
+        "attempts": attempts,
+        "interval": interval,
+    }
+    connector = aiohttp.TCPConnector(ssl=tls or True)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        offsets = await asyncio.gather(
+            *(_clock_offset(session, agent, token) for agent in agents),
+            return_exceptions=True,
+        )
+        # an agent that cannot be synchronized is left out, the others share its attempts
+        results, racing = [], []
+        for agent, offset in zip(agents, offsets):
+            if isinstance(offset, Exception):
+                results.append(
+                    AgentResult(
+                        agent=agent, success=False, attempts=0, error=repr(offset)
+                    )
+                )
+                logger.error(f"AgentResult: {results[-1]}")
+            else:
+                racing.append((agent, offset))
+        logger.info(
+            "AgentClockOffsets: "
+            + ", ".join(f"{a}={o * 1000:.1f}ms" for a, o in racing)
+        )
+        shared["agents"] = len(racing)
+        pending = {
+            asyncio.create_task(
+                _race_agent(session, agent, {**shared, "index": index}, offset, token)
+            ): agent
+            for index, (agent, offset) in enumerate(racing)
+        }
+        stopped = False
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                del pending[task]
+                results.append(task.result())
+                logger.info(f"AgentResult: {task.result()}")
+            if not stopped and any(result.success for result in results):
+                stopped = True
+                await _stop_agents(
+                    session, list(pending.values()), race_id, token, logger
+                )
+    return results
+
+
+def coordinate(
+    agents: list[str],
+    meeting: ScheduleRoomCommand,
+    send_booking_time: datetime,
+    logger: logging.Logger,
+    share_session: bool = True,
+    trusted_network: bool = False,
+    tls: Optional[ssl.SSLContext] = None,
+) -> bool:
+    """
+    the same head start as a single node: log in ten seconds ahead, then race
+    """
+    _check_agent_urls(agents, trusted_network)  # before waiting for the head start
+    from schedule_room import _sleep_until
+
+    profile = active_profile()
+    _sleep_until(send_booking_time - timedelta(seconds=10))
+    session_credentials = (
+        query_session_creds(meeting.credentials, profile) if share_session else None
+    )
+    fire_at = datetime.now().replace(
+        hour=send_booking_time.hour,
+        minute=send_booking_time.minute,
+        second=send_booking_time.second,
+        microsecond=0,
+    )
+    if fire_at < datetime.now():
+        fire_at += timedelta(days=1)
+    results = asyncio.run(
+        race(
+            agents,
+            meeting,
+            fire_at.timestamp(),
+            logger,
+            session_credentials,
+            profile,
+            trusted_network=trusted_network,
+            tls=tls,
+        )
+    )
+    return any(result.success for result in results)
+
+
+def _main(argv: Optional[list[str]] = None):
+    import argparse
+    import socket
+    import sys
+
+    parser = argparse.ArgumentParser(
+        description="race a booking from several machines at once"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    agent = commands.add_parser("agent", help="serve races for a coordinator")
+    agent.add_argument("--host", default="0.0.0.0")
+    agent.add_argument("--port", type=int, default=8700)
+    agent.add_argument("--name", default=socket.gethostname())
+    agent.add_argument(
+        "--cert", help="pem with the agent's certificate and key, serves https"
+    )
+    agent.add_argument(
+        "--trusted-network",
+        action="store_true",
+        help="serve plain http beyond this machine, on a network you trust",
+    )
+    coordinator = commands.add_parser(
+        "coordinate", help="book a room with every agent, credentials from env"
+    )
+    coordinator.add_argument("--agent", action="append", required=True)
+    coordinator.add_argument("--room", required=True, help="room id")
+    coordinator.add_argument("--time", type=datetime.fromisoformat, required=True)
+    coordinator.add_argument(
+        "--at",
+        type=lambda at: datetime.strptime(at, "%H:%M:%S"),
+        required=True,
+        help="when booking opens",
+    )
+    coordinator.add_argument(
+        "--per-agent-login",
+        action="store_true",
+        help="every agent logs in on its own, with the credentials in its env",
+    )
+    coordinator.add_argument(
+        "--agent-ca", help="certificates the agents' own certificates are checked with"
+    )
+    coordinator.add_argument(
+        "--trusted-network",
+        action="store_true",
+        help="allow plain http agents, on a network you trust",
+    )
+    args = parser.parse_args(argv)
+
+    logger = logging.getLogger("cluster")
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+    if args.command == "agent":
+        if not _is_loopback(args.host):
+            if not os.environ.get(_TOKEN_ENV):
+                parser.error(f"set {_TOKEN_ENV} to serve beyond this machine")
+            if args.cert is None and not args.trusted_network:
+                parser.error(
+                    "serve beyond this machine with --cert or --trusted-network"
+                )
+        tls = None
+        if args.cert:
+            tls = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            tls.load_cert_chain(args.cert)
+        web.run_app(
+            agent_app(args.name, logger),
+            host=args.host,
+            port=args.port,
+            ssl_context=tls,
+            print=None,
+        )
+        return
+    meeting = ScheduleRoomCommand(
+        time=args.time, room=args.room, credentials=Credentials()
+    )
+    try:
+        _check_agent_urls(args.agent, args.trusted_network)
+    except ValueError as e:
+        parser.error(str(e))
+    tls = ssl.create_default_context(cafile=args.agent_ca) if args.agent_ca else None
+    booked = coordinate(
+        args.agent,
+        meeting,
+        args.at,
+        logger,
+        share_session=not args.per_agent_login,
+        trusted_network=args.trusted_network,
+        tls=tls,
+    )
+    print("booked" if booked else "failed")
+
+
+if __name__ == "__main__":
+    _main()
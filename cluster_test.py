@@ -0,0 +1,241 @@
+import asyncio
+import dataclasses
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import aiohttp
+import pytest
+import requests
+from aiohttp import web
+
+import site_profile
+from cluster import _TOKEN_ENV, _clock_offset, _main, race
+from conftest import BOOKED_PAGE, StandInSite, free_port, stand_in_config
+from models import Credentials, ScheduleRoomCommand
+from site_profile import load_profile
+from visual_theater import query_session_creds
+
+logger = logging.getLogger()
+
+_AGENTS = 3
+_TOKEN_PAGE = '<form><input type="hidden" name="form_token" value="token" /></form>'
+_TAKEN_PAGE = '<div class="alert-dismissible">החדר תפוס</div>'
+
+
+class Site:
+    """
+    counts logins and bookings, the booking attempt numbered succeed_on succeeds
+    """
+
+    def __init__(self):
+        self.succeed_on = None
+        self.logins = 0
+        self.bookings: list[float] = []
+        self._lock = threading.Lock()
+        self.routes = web.RouteTableDef()
+        self.routes.route("*", "/{tail:.*}")(self._handle)
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        if request.method == "GET":
+            return web.Response(text=_TOKEN_PAGE, content_type="text/html")
+        await request.post()
+        if request.path == "/he":
+            with self._lock:
+                self.logins += 1
+            response = web.Response(text="")
+            response.set_cookie("SESS1", "session-id")
+            return response
+        with self._lock:
+            self.bookings.append(time.time())
+            booked = len(self.bookings) == self.succeed_on
+        return web.Response(
+            text=BOOKED_PAGE if booked else _TAKEN_PAGE, content_type="text/html"
+        )
+
+    def reset(self, succeed_on=None):
+        with self._lock:
+            self.succeed_on = succeed_on
+            self.logins = 0
+            self.bookings = []
+
+
+def _wait_for_agent(url: str, process: subprocess.Popen):
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        assert process.poll() is None, "agent exited"
+        try:
+            requests.get(f"{url}/clock", timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    raise TimeoutError(url)
+
+
+@pytest.fixture(scope="module")
+def cluster(tmp_path_factory):
+    site = Site()
+    stand_in = StandInSite(site.routes, ("127.0.0.1",)).start()
+    config = stand_in_config(f"{stand_in.url}/he")
+    profile_path = tmp_path_factory.mktemp("cluster") / "stand_in.json"
+    profile_path.write_text(config.model_dump_json(), encoding="utf-8")
+
+    # agents logging in on their own use the credentials in their env
+    env = {
+        **os.environ,
+        "SITE_PROFILE": str(profile_path),
+        "USERNAME": "agent-user",
+        "PASSWORD": "agent-pass",
+    }
+    env.pop(_TOKEN_ENV, None)
+    agents, processes = [], []
+    for index in range(_AGENTS):
+        port = free_port()
+        processes.append(
+            subprocess.Popen(
+                [sys.executable, "cluster.py", "agent", "--host", "127.0.0.1"]
+                + ["--port", str(port), "--name", f"agent-{index}"],
+                cwd=Path(__file__).parent,
+                env=env,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        )
+        agents.append(f"http://127.0.0.1:{port}")
+    try:
+        for url, process in zip(agents, processes):
+            _wait_for_agent(url, process)
+        yield site, agents, load_profile(profile_path)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        stand_in.stop()
+
+
+def _meeting() -> ScheduleRoomCommand:
+    return ScheduleRoomCommand(
+        time=datetime(2024, 5, 26, 8, 0),
+        room="14343",
+        credentials=Credentials(username="my-user", password="my-pass"),
+    )
+
+
+def test_clocks_are_synchronized(cluster):
+    _, agents, _ = cluster
+
+    async def offsets():
+        async with aiohttp.ClientSession() as session:
+            return [await _clock_offset(session, agent, None) for agent in agents]
+
+    # same machine, same clock
+    assert all(abs(offset) < 0.05 for offset in asyncio.run(offsets()))
+
+
+def test_first_success_stops_every_agent(cluster, monkeypatch):
+    site, agents, profile = cluster
+    monkeypatch.setattr(site_profile, "_active_profile", profile)
+    site.reset(succeed_on=5)
+    creds = query_session_creds(_meeting().credentials, profile)
+    fire_at = time.time() + 1
+
+    results = asyncio.run(race(agents, _meeting(), fire_at, logger, creds))
+
+    assert [result.success for result in results].count(True) == 1
+    assert all(result.error is None for result in results)
+    assert site.logins == 1  # one session shared by every agent
+    assert 5 <= len(site.bookings) < 30
+    # the cluster keeps a single node's pace, the agents take turns
+    first, fifth = site.bookings[0], site.bookings[4]
+    assert first >= fire_at - 0.05
+    assert 0.25 < fifth - first < 0.6
+
+
+def test_agents_log_in_on_their_own(cluster, monkeypatch):
+    site, agents, profile = cluster
+    monkeypatch.setattr(site_profile, "_active_profile", profile)
+    site.reset()
+
+    results = asyncio.run(race(agents, _meeting(), time.time() + 1, logger, attempts=9))
+
+    assert not any(result.success for result in results)
+    assert sorted(result.attempts for result in results) == [3, 3, 3]
+    assert site.logins == _AGENTS
+    assert len(site.bookings) == 9
+
+
+def test_agents_refuse_another_profile(cluster, monkeypatch):
+    site, agents, profile = cluster
+    site.reset(succeed_on=1)
+    other = dataclasses.replace(profile, name="other_site")
+
+    results = asyncio.run(
+        race(agents, _meeting(), time.time() + 1, logger, profile=other)
+    )
+
+    assert all("409" in result.error for result in results)
+    assert site.bookings == []
+
+
+def _fake_agent(races: list) -> web.RouteTableDef:
+    routes = web.RouteTableDef()
+
+    @routes.get("/clock")
+    async def clock(request: web.Request) -> web.Response:
+        return web.json_response({"time": time.time()})
+
+    @routes.post("/race")
+    async def run_race(request: web.Request) -> web.Response:
+        races.append(await request.json())
+        return web.json_response({"agent": "a", "success": False, "attempts": 0})
+
+    return routes
+
+
+def test_races_carry_no_password(stand_in_site):
+    races = []
+    agent = stand_in_site(_fake_agent(races)).url
+    asyncio.run(race([agent], _meeting(), time.time(), logger))
+    assert races and races[0]["session"] is None
+    assert "my-pass" not in json.dumps(races)
+
+
+def test_races_go_on_without_the_agents_out_of_reach(stand_in_site):
+    races = []
+    refusing = web.RouteTableDef()
+
+    @refusing.get("/clock")
+    async def clock(request: web.Request) -> web.Response:
+        raise web.HTTPUnauthorized()
+
+    unreachable = f"http://127.0.0.1:{free_port()}"
+    unauthorized = stand_in_site(refusing).url
+    agent = stand_in_site(_fake_agent(races)).url
+    results = asyncio.run(
+        race([unreachable, unauthorized, agent], _meeting(), time.time(), logger)
+    )
+    assert [r.agent for r in results if r.error] == [unreachable, unauthorized]
+    assert [(r["index"], r["agents"]) for r in races] == [(0, 1)]
+
+
+def test_remote_agents_must_be_https():
+    with pytest.raises(ValueError):
+        asyncio.run(race(["http://192.0.2.1:8700"], _meeting(), time.time(), logger))
+
+
+def test_agents_serve_other_machines_only_with_a_token(monkeypatch):
+    monkeypatch.delenv(_TOKEN_ENV, raising=False)
+    with pytest.raises(SystemExit):
+        _main(["agent", "--host", "0.0.0.0", "--trusted-network"])
+
+
+def test_agents_serve_other_machines_only_over_tls(monkeypatch):
+    monkeypatch.setenv(_TOKEN_ENV, "secret")
+    with pytest.raises(SystemExit):
+        _main(["agent", "--host", "0.0.0.0"])
@@ -0,0 +1,93 @@
+import asyncio
+import socket
+import threading
+
+import pytest
+from aiohttp import web
+
+from site_profile import (
+    SiteProfile,
+    SiteProfileConfig,
+    _DEFAULT_PROFILE_PATH,
+    compile_profile,
+)
+
+# about what the site answers a booking with, the message sits between other blocks
+BOOKED_PAGE = (
+    "<html><body><div class='region'>navigation</div>"
+    '<div class="alert alert-dismissible"><div>הזמנה של my-user נוצר.</div></div>'
+    "<p>the rest of the page</p></body></html>"
+)
+
+
+def free_port(host: str = "127.0.0.1") -> int:
+    with socket.socket() as probe:
+        probe.bind((host, 0))
+        return probe.getsockname()[1]
+
+
+def stand_in_config(base_url: str) -> SiteProfileConfig:
+    """
+    the default profile pointed at a stand-in site
+    """
+    config = SiteProfileConfig.model_validate_json(
+        _DEFAULT_PROFILE_PATH.read_text(encoding="utf-8")
+    )
+    return config.model_copy(update={"base_url": base_url})
+
+
+def stand_in_profile(base_url: str) -> SiteProfile:
+    return compile_profile(stand_in_config(base_url))
+
+
+class StandInSite:
+    """
+    an aiohttp app in place of the site, on one port of every address. it runs on its own
+    loop so tests, the loops of the code under test and other processes can all reach it
+    """
+
+    def __init__(self, routes: web.RouteTableDef, addresses: tuple[str, ...]):
+        self.addresses = addresses
+        self.port = free_port(addresses[0])
+        self._routes = routes
+        self._loop = asyncio.new_event_loop()
+        self._runner = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.addresses[0]}:{self.port}"
+
+    async def _start(self):
+        app = web.Application()
+        app.add_routes(self._routes)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        for address in self.addresses:
+            await web.TCPSite(self._runner, address, self.port).start()
+
+    def start(self) -> "StandInSite":
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+        return self
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+@pytest.fixture
+def stand_in_site():
+    """
+    starts a stand-in site for the routes given, stopped when the test is done
+    """
+    sites = []
+
+    def start(
+        routes: web.RouteTableDef, addresses: tuple[str, ...] = ("127.0.0.1",)
+    ) -> StandInSite:
+        sites.append(StandInSite(routes, addresses).start())
+        return sites[-1]
+
+    yield start
+    for site in sites:
+        site.stop()
@@ -0,0 +1,320 @@
+import asyncio
+import collections
+import dataclasses
+import itertools
+import logging
+import socket
+import statistics
+import time
+import urllib.parse
+from typing import Optional
+
+import aiohttp
+from aiohttp.abc import AbstractResolver, ResolveResult
+
+from governor import Priority, governor
+from http_transport import HttpResponse, _lower, ssl_context
+
+_PROBES_PER_ADDRESS = 3
+# seconds for probing every address, one slower than this is not worth a connection
+_MEASURE_DEADLINE = 2.0
+_FASTEST_PATHS = 3
+# an attempt is hedged once it takes twice what the path's responses usually take,
+# the site's own work dwarfs the round trip
+_HEDGE_LATENCY_MULTIPLIER = 2
+_LATENCY_SAMPLES = 16  # latest responses per path the budget is based on
+_UNWARMED_BUDGET = 1.0  # seconds, for a path without a response yet
+_MIN_HEDGE_BUDGET = 0.25  # seconds
+_WARM_CONNECTIONS = 2  # per path, attempts in flight together on a path
+_STRAGGLER_DRAIN = 5.0  # seconds the losers get on close before they are cancelled
+
+
+@dataclasses.dataclass(frozen=True)
+class NetworkPath:
+    address: str
+    port: int
+    rtt: float  # seconds, median tcp connect time
+
+
+def _host_and_port(url: str) -> tuple[str, int]:
+    parts = urllib.parse.urlsplit(url)
+    return parts.hostname, parts.port or (443 if parts.scheme == "https" else 80)
+
+
+def resolve_addresses(host: str, port: int) -> list[str]:
+    """
+    every address the host resolves to, in resolver order
+    """
+    infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    return list(dict.fromkeys(info[4][0] for info in infos))
+
+
+async def _measure_path(address: str, port: int) -> NetworkPath:
+    rtts = []
+    for _ in range(_PROBES_PER_ADDRESS):
+        started = time.perf_counter()
+        _, writer = await asyncio.open_connection(address, port)
+        rtts.append(time.perf_counter() - started)
+        writer.close()
+    return NetworkPath(address=address, port=port, rtt=statistics.median(rtts))
+
+
+async def _measure_paths(
+    addresses: list[str], port: int, logger: logging.Logger, deadline: float
+) -> list[NetworkPath]:
+    probes = {
+        asyncio.create_task(_measure_path(address, port)): address
+        for address in addresses
+    }
+    done, pending = await asyncio.wait(probes, timeout=deadline)
+    for probe in pending:
+        probe.cancel()
+        logger.info(f"PathTooSlow: {probes[probe]}")
+    await asyncio.gather(*pending, return_exceptions=True)
+    paths = []
+    for probe in done:
+        if probe.exception() is not None:
+            logger.info(f"PathUnreachable: {probes[probe]} {probe.exception()}")
+            continue
+        paths.append(probe.result())
+    return sorted(paths, key=lambda path: path.rtt)
+
+
+def measure_paths(
+    addresses: list[str],
+    port: int,
+    logger: logging.Logger,
+    deadline: float = _MEASURE_DEADLINE,
+) -> list[NetworkPath]:
+    """
+    tcp connect time to every address, fastest first. addresses are probed at once and
+    the whole measurement takes at most deadline seconds, addresses unreachable
+    or not measured by then are dropped
+    """
+    return asyncio.run(_measure_paths(addresses, port, logger, deadline))
+
+
+def measure_site_paths(
+    url: str, logger: logging.Logger, deadline: float = _MEASURE_DEADLINE
+) -> list[NetworkPath]:
+    host, port = _host_and_port(url)
+    paths = measure_paths(resolve_addresses(host, port), port, logger, deadline)
+    logger.info(
+        "PathsMeasured: "
+        + ", ".join(f"{path.address}={path.rtt * 1000:.1f}ms" for path in paths)
+    )
+    return paths
+
+
+class _PinnedResolver(AbstractResolver):
+    """
+    resolves any host to one address, the url keeps its host name for tls and the host header
+    """
+
+    def __init__(self, address: str):
+        self.address = address
+        self.family = socket.AF_INET6 if ":" in address else socket.AF_INET
+
+    async def resolve(
+        self, host: str, port: int = 0, family: int = socket.AF_INET
+    ) -> list[ResolveResult]:
+        return [
+            ResolveResult(
+                hostname=host,
+                host=self.address,
+                port=port,
+                family=self.family,
+                proto=0,
+                flags=socket.AI_NUMERICHOST,
+            )
+        ]
+
+    async def close(self):
+        pass
+
+
+class HedgedDispatcher:
+    """
+    sends posts round robin over the fastest measured paths, each path keeping its own
+    connections alive between attempts. an attempt without a response within its path's
+    budget, twice the path's usual response time, is sent again on the next path and
+    whichever response comes first is returned. warm opens the connections and gives
+    every path its first response times ahead of the burst.
+    the loser is not cancelled, the site may already be handling it, it is drained on close.
+    with an account, hedges wait for the governor like any burst attempt and the losers'
+    responses are reported to it, the caller reports the one it gets.
+    only post_async is offered, the burst is the only caller
+    """
+
+    def __init__(
+        self,
+        paths: list[NetworkPath],
+        fastest: int = _FASTEST_PATHS,
+        min_budget: float = _MIN_HEDGE_BUDGET,
+        account: Optional[str] = None,
+    ):
+        if not paths:
+            raise ValueError("no path to dispatch on")
+        self.paths = paths[:fastest]
+        self.min_budget = min_budget
+        self.account = account
+        self._sessions: dict[NetworkPath, aiohttp.ClientSession] = {}
+        self._latencies = {
+            path: collections.deque(maxlen=_LATENCY_SAMPLES) for path in self.paths
+        }
+        self._next_path = itertools.cycle(range(len(self.paths)))
+        self._stragglers: set[asyncio.Task] = set()
+        self._metrics = {"attempts": 0, "hedges": 0, "hedges_won": 0}
+
+    async def __aenter__(self) -> "HedgedDispatcher":
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def open(self):
+        for path in self.paths:
+            self._sessions[path] = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    resolver=_PinnedResolver(path.address), ssl=ssl_context()
+                ),
+                cookie_jar=aiohttp.DummyCookieJar(),  # cookies are sent per attempt
+            )
+
+    async def warm(
+        self,
+        url: str,
+        headers: dict[str, str],
+        cookies: dict[str, str],
+        connections: int = _WARM_CONNECTIONS,
+    ):
+        """
+        gets url over connections at once on every path, the connections are kept
+        for the attempts. raises when no path answered
+        """
+        host = urllib.parse.urlsplit(url).netloc
+
+        async def get(path: NetworkPath):
+            if self.account is not None:
+                await governor.acquire_async(host, self.account, Priority.BOOKING)
+            started = time.monotonic()
+            async with self._sessions[path].get(
+                url, headers=headers, cookies=cookies
+            ) as response:
+                await response.read()
+            self._latencies[path].append(time.monotonic() - started)
+            if self.account is not None:
+                governor.report(
+                    host,
+                    response.status,
+                    time.monotonic() - started,
+                    response.headers.get("retry-after"),
+                )
+
+        results = await asyncio.gather(
+            *(get(path) for path in self.paths for _ in range(connections)),
+            return_exceptions=True,
+        )
+        if all(isinstance(result, BaseException) for result in results):
+            raise results[0]
+
+    async def close(self):
+        if self._stragglers:
+            _, pending = await asyncio.wait(
+                set(self._stragglers), timeout=_STRAGGLER_DRAIN
+            )
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        for session in self._sessions.values():
+            await session.close()
+        self._sessions.clear()
+
+    def budget(self, path: NetworkPath) -> float:
+        if not self._latencies[path]:
+            return max(self.min_budget, _UNWARMED_BUDGET)
+        latency = statistics.median(self._latencies[path])
+        return max(self.min_budget, _HEDGE_LATENCY_MULTIPLIER * latency)
+
+    def metrics(self) -> dict[str, int]:
+        return dict(self._metrics)
+
+    async def _post(
+        self,
+        path: NetworkPath,
+        url: str,
+        headers: dict[str, str],
+        cookies: dict[str, str],
+        data: dict,
+    ) -> HttpResponse:
+        started = time.monotonic()
+        async with self._sessions[path].post(
+            url, headers=headers, cookies=cookies, data=data
+        ) as response:
+            text = await response.text()
+            self._latencies[path].append(time.monotonic() - started)
+            return HttpResponse(
+                status=response.status,
+                headers=_lower(response.headers),
+                text=text,
+                cookies={
+                    **cookies,
+                    **{name: c.value for name, c in response.cookies.items()},
+                },
+            )
+
+    def _report(self, url: str, started: float, task: asyncio.Task):
+        if self.account is None or task.cancelled() or task.exception() is not None:
+            return
+        response = task.result()
+        governor.report(
+            urllib.parse.urlsplit(url).netloc,
+            response.status,
+            time.monotonic() - started,
+            response.headers.get("retry-after"),
+        )
+
+    def _straggle(self, task: asyncio.Task, url: str, started: float):
+        self._stragglers.add(task)
+        task.add_done_callback(self._stragglers.discard)
+        task.add_done_callback(lambda _: self._report(url, started, task))
+
+    async def post_async(
+        self, url: str, headers: dict[str, str], cookies: dict[str, str], data: dict
+    ) -> HttpResponse:
+        self._metrics["attempts"] += 1
+        index = next(self._next_path)
+        path = self.paths[index]
+        started = time.monotonic()
+        first = asyncio.create_task(self._post(path, url, headers, cookies, data))
+        done, _ = await asyncio.wait({first}, timeout=self.budget(path))
+        if done and first.exception() is None:
+            return first.result()
+
+        # a failed attempt is sent again right away.
+        # with a single path the duplicate still gets a fresh connection of its own
+        self._metrics["hedges"] += 1
+        hedge_path = self.paths[(index + 1) % len(self.paths)]
+        if self.account is not None:
+            await governor.acquire_async(
+                urllib.parse.urlsplit(url).netloc, self.account, Priority.BURST
+            )
+        hedge_started = time.monotonic()
+        hedge = asyncio.create_task(self._post(hedge_path, url, headers, cookies, data))
+        sent = {first: started, hedge: hedge_started}
+        pending = {first, hedge}
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            winner = next((task for task in done if task.exception() is None), None)
+            if winner is None and pending:
+                continue  # one path failed, the other may still answer
+            for task in pending:
+                self._straggle(task, url, sent[task])
+            if winner is None:
+                return first.result()  # both failed, raises the first attempt's error
+            if winner is hedge:
+                self._metrics["hedges_won"] += 1
+            return winner.result()
@@ -0,0 +1,270 @@
+import asyncio
+import logging
+import socket
+import time
+from datetime import datetime
+
+import pytest
+from aiohttp import web
+
+import dispatch
+from conftest import BOOKED_PAGE, free_port, stand_in_profile
+from dispatch import HedgedDispatcher, NetworkPath, measure_paths
+from governor import governor
+from models import FormToken, SessionCookie, SessionCredentials
+from visual_theater import book_room
+
+logger = logging.getLogger()
+
+_FAST = "127.0.0.1"
+_SLOW = "127.0.0.2"
+_DOWN = "127.0.0.3"  # nothing listens there
+
+
+class StandIn:
+    """
+    the same site on two addresses sharing a port, one of them booking late.
+    every answer takes the site's own work first
+    """
+
+    def __init__(self, stand_in_site, slow_seconds: float, work_seconds: float = 0):
+        self.slow_seconds = slow_seconds
+        self.work_seconds = work_seconds
+        self.hits = {_FAST: 0, _SLOW: 0}
+        self.connections = set()
+        routes = web.RouteTableDef()
+        routes.get("/{tail:.*}")(self._page)
+        routes.post("/{tail:.*}")(self._book)
+        self.port = stand_in_site(routes, (_FAST, _SLOW)).port
+
+    async def _page(self, request: web.Request) -> web.Response:
+        self.connections.add(request.transport)
+        await asyncio.sleep(self.work_seconds)
+        return web.Response(text="<html></html>", content_type="text/html")
+
+    async def _book(self, request: web.Request) -> web.Response:
+        self.connections.add(request.transport)
+        address = request.transport.get_extra_info("sockname")[0]
+        self.hits[address] += 1
+        await request.post()
+        await asyncio.sleep(self.work_seconds)
+        if address == _SLOW:
+            await asyncio.sleep(self.slow_seconds)
+        return web.Response(text=BOOKED_PAGE, content_type="text/html")
+
+    def path(self, address: str, rtt: float = 0.001) -> NetworkPath:
+        return NetworkPath(address=address, port=self.port, rtt=rtt)
+
+    def url(self) -> str:
+        # the host name never resolves, every path pins its own address
+        return f"http://stand-in.test:{self.port}/book"
+
+
+@pytest.fixture
+def stand_in(stand_in_site):
+    return lambda slow_seconds, work_seconds=0: StandIn(
+        stand_in_site, slow_seconds, work_seconds
+    )
+
+
+async def _post(dispatcher: HedgedDispatcher, url: str):
+    return await dispatcher.post_async(url, {}, {"SESS1": "id"}, {"field": "value"})
+
+
+async def _warm(dispatcher: HedgedDispatcher, url: str):
+    await dispatcher.warm(url, {}, {"SESS1": "id"})
+
+
+def test_unreachable_addresses_are_dropped():
+    with socket.create_server((_FAST, 0)) as listener:
+        port = listener.getsockname()[1]
+        paths = measure_paths([_DOWN, _FAST], port, logger)
+    assert [path.address for path in paths] == [_FAST]
+    assert paths[0].rtt > 0
+
+
+def test_measuring_keeps_to_its_deadline():
+    with socket.create_server((_FAST, 0), backlog=0) as listener:
+        port = listener.getsockname()[1]
+        # a full accept queue leaves further connects hanging, like a distant address
+        queued = [socket.socket() for _ in range(3)]
+        for connection in queued:
+            connection.setblocking(False)
+            connection.connect_ex((_FAST, port))
+        started = time.perf_counter()
+        paths = measure_paths([_FAST], port, logger, deadline=0.3)
+        elapsed = time.perf_counter() - started
+        for connection in queued:
+            connection.close()
+    assert paths == []
+    assert elapsed < 1
+
+
+def test_attempts_are_spread_over_paths(stand_in):
+    stand_in = stand_in(slow_seconds=0)
+
+    async def scenario():
+        paths = [stand_in.path(_FAST), stand_in.path(_SLOW)]
+        async with HedgedDispatcher(paths) as dispatcher:
+            for _ in range(4):
+                response = await _post(dispatcher, stand_in.url())
+                assert response.text == BOOKED_PAGE
+                assert response.cookies == {"SESS1": "id"}
+        return dispatcher.metrics()
+
+    metrics = asyncio.run(scenario())
+    assert stand_in.hits == {_FAST: 2, _SLOW: 2}
+    assert metrics == {"attempts": 4, "hedges": 0, "hedges_won": 0}
+
+
+def test_slow_path_is_hedged(stand_in):
+    stand_in = stand_in(slow_seconds=1)
+
+    async def scenario():
+        paths = [stand_in.path(_SLOW), stand_in.path(_FAST)]
+        async with HedgedDispatcher(paths, min_budget=0.05) as dispatcher:
+            await _warm(dispatcher, stand_in.url())
+            started = time.perf_counter()
+            response = await _post(dispatcher, stand_in.url())
+            elapsed = time.perf_counter() - started
+        # the slow attempt was drained, not cancelled
+        return response, elapsed, dispatcher.metrics()
+
+    response, elapsed, metrics = asyncio.run(scenario())
+    assert response.text == BOOKED_PAGE
+    assert elapsed < 0.5
+    assert stand_in.hits == {_FAST: 1, _SLOW: 1}
+    assert metrics == {"attempts": 1, "hedges": 1, "hedges_won": 1}
+
+
+def test_stragglers_are_drained_for_a_bounded_time(stand_in, monkeypatch):
+    monkeypatch.setattr(dispatch, "_STRAGGLER_DRAIN", 0.2)
+    stand_in = stand_in(slow_seconds=2)
+
+    async def scenario():
+        paths = [stand_in.path(_SLOW), stand_in.path(_FAST)]
+        dispatcher = HedgedDispatcher(paths, min_budget=0.05)
+        async with dispatcher:
+            await _warm(dispatcher, stand_in.url())
+            await _post(dispatcher, stand_in.url())
+            started = time.perf_counter()
+        return time.perf_counter() - started
+
+    assert asyncio.run(scenario()) < 1
+
+
+def test_hedges_are_governed(stand_in):
+    stand_in = stand_in(slow_seconds=0.3)
+    host = f"stand-in.test:{stand_in.port}"
+
+    async def scenario():
+        paths = [stand_in.path(_SLOW), stand_in.path(_FAST)]
+        async with HedgedDispatcher(
+            paths, min_budget=0.05, account="my-account"
+        ) as dispatcher:
+            await _warm(dispatcher, stand_in.url())
+            await _post(dispatcher, stand_in.url())
+
+    asyncio.run(scenario())
+    metrics = governor.metrics()[host]
+    assert metrics["requests.burst"] == 1  # the hedge, the caller governs the attempt
+    assert "current_rate" in metrics  # the slow loser was reported once it answered
+
+
+def test_budget_follows_the_sites_response_time(stand_in):
+    # a site taking longer than a round trip to save is not hedged on every attempt
+    stand_in = stand_in(slow_seconds=0, work_seconds=0.3)
+
+    async def scenario():
+        paths = [stand_in.path(_FAST), stand_in.path(_SLOW)]
+        async with HedgedDispatcher(paths, min_budget=0.05) as dispatcher:
+            unwarmed = dispatcher.budget(paths[0])
+            await _warm(dispatcher, stand_in.url())
+            for _ in range(4):
+                await _post(dispatcher, stand_in.url())
+            return unwarmed, dispatcher.budget(paths[0]), dispatcher.metrics()
+
+    unwarmed, budget, metrics = asyncio.run(scenario())
+    assert unwarmed == dispatch._UNWARMED_BUDGET
+    assert 0.6 <= budget < unwarmed
+    assert metrics == {"attempts": 4, "hedges": 0, "hedges_won": 0}
+
+
+def test_warming_opens_the_connections_ahead(stand_in):
+    stand_in = stand_in(slow_seconds=0, work_seconds=0.1)
+
+    async def scenario():
+        paths = [stand_in.path(_FAST), stand_in.path(_SLOW)]
+        async with HedgedDispatcher(paths) as dispatcher:
+            await dispatcher.warm(stand_in.url(), {}, {}, connections=2)
+            warmed = set(stand_in.connections)
+            await asyncio.gather(*(_post(dispatcher, stand_in.url()) for _ in range(4)))
+        return warmed
+
+    warmed = asyncio.run(scenario())
+    assert len(warmed) == 4
+    assert stand_in.connections == warmed
+
+
+def test_warming_fails_when_no_path_answers():
+    async def scenario():
+        down = NetworkPath(address=_DOWN, port=free_port(), rtt=0.001)
+        async with HedgedDispatcher([down]) as dispatcher:
+            await _warm(dispatcher, f"http://stand-in.test:{down.port}/book")
+
+    with pytest.raises(OSError):
+        asyncio.run(scenario())
+
+
+def test_failed_path_is_retried_on_the_next(stand_in):
+    stand_in = stand_in(slow_seconds=0)
+
+    async def scenario():
+        paths = [stand_in.path(_DOWN), stand_in.path(_FAST)]
+        async with HedgedDispatcher(paths, min_budget=5) as dispatcher:
+            started = time.perf_counter()
+            response = await _post(dispatcher, stand_in.url())
+            elapsed = time.perf_counter() - started
+        return response, elapsed, dispatcher.metrics()
+
+    response, elapsed, metrics = asyncio.run(scenario())
+    assert response.text == BOOKED_PAGE
+    assert elapsed < 1  # no waiting for the budget
+    assert metrics == {"attempts": 1, "hedges": 1, "hedges_won": 1}
+
+
+def test_all_paths_failing_raises():
+    async def scenario():
+        down = NetworkPath(address=_DOWN, port=free_port(), rtt=0.001)
+        async with HedgedDispatcher([down]) as dispatcher:
+            await _post(dispatcher, f"http://stand-in.test:{down.port}/book")
+
+    with pytest.raises(OSError):
+        asyncio.run(scenario())
+
+
+def test_book_room_through_dispatcher(stand_in):
+    stand_in = stand_in(slow_seconds=1)
+    profile = stand_in_profile(f"http://stand-in.test:{stand_in.port}")
+    creds = SessionCredentials(
+        cookie=SessionCookie({"SESS1": "id"}),
+        form_token=FormToken("token"),
+        account="my-account",
+    )
+
+    async def scenario():
+        paths = [stand_in.path(_SLOW), stand_in.path(_FAST)]
+        async with HedgedDispatcher(
+            paths, min_budget=0.05, account=creds.account
+        ) as dispatcher:
+            await _warm(dispatcher, stand_in.url())
+            return await book_room(
+                creds,
+                datetime(2024, 5, 26, 8, 0),
+                "14343",
+                logger,
+                profile,
+                sender=dispatcher,
+            )
+
+    assert asyncio.run(scenario())
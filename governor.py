@@ -0,0 +1,201 @@
+import asyncio
+import enum
+import hashlib
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Optional
+
+
+class Priority(enum.IntEnum):
+    """
+    lower value goes first
+    """
+
+    BURST = 0  # booking attempts around the booking time
+    BOOKING = 1  # login, form token and alternative booking
+    POLLING = 2  # availability queries
+    BACKGROUND = 3  # warm-up and room catalog refresh
+
+
+# share of a bucket each priority must leave untouched, so there are always tokens for the burst
+_RESERVED_SHARE = {
+    Priority.BURST: 0.0,
+    Priority.BOOKING: 0.2,
+    Priority.POLLING: 0.4,
+    Priority.BACKGROUND: 0.6,
+}
+# polling and background traffic waits while burst traffic was seen this recently
+_BURST_QUIET_PERIOD = 1.0  # seconds
+_PREEMPTED_BY_BURST = (Priority.POLLING, Priority.BACKGROUND)
+
+_HOST_RATE = 20.0  # requests per second
+_HOST_CAPACITY = 40.0
+_ACCOUNT_RATE = 15.0
+_ACCOUNT_CAPACITY = 35.0
+
+_MIN_RATE_SHARE = 0.25  # backoff never slows a bucket below this share of its rate
+_SLOW_RESPONSE = 3.0  # seconds
+_INITIAL_BACKOFF = 0.5  # seconds, doubled on consecutive errors
+_MAX_BACKOFF = 30.0
+_MAX_WAIT_STEP = 0.5  # waiters re-check at least this often
+
+
+class _TokenBucket:
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float, priority: Priority) -> float:
+        """
+        seconds until a token is available for this priority, 0 if available now
+        """
+        self._refill(now)
+        floor = self.capacity * _RESERVED_SHARE[priority]
+        missing = floor + 1 - self.tokens
+        if missing <= 0:
+            return 0.0
+        return missing / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def slow_down(self, factor: float):
+        self.rate = max(self.base_rate * _MIN_RATE_SHARE, self.rate * factor)
+
+    def recover(self):
+        self.rate = min(self.base_rate, self.rate + self.base_rate * 0.1)
+
+
+class _HostState:
+    def __init__(self, now: float):
+        self.bucket = _TokenBucket(_HOST_RATE, _HOST_CAPACITY, now)
+        self.backoff_until = 0.0
+        self.backoff = _INITIAL_BACKOFF
+        self.burst_until = 0.0
+
+
+def account_key(username: str) -> str:
+    """
+    accounts are identified by a hash of their username, the same for every session
+    of the account. the username itself is never kept
+    """
+    return hashlib.sha1(username.encode("utf-8")).hexdigest()[:12]
+
+
+class Governor:
+    """
+    token buckets per host and per account shared by every outbound request, in every thread.
+    a request waits until both buckets have a token for its priority, lower priorities leave
+    a reserved share of each bucket to higher ones and are held back during a burst
+    and while the host is backing off
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._hosts: dict[str, _HostState] = {}
+        self._accounts: dict[str, _TokenBucket] = {}
+        self._metrics = defaultdict(lambda: defaultdict(float))
+
+    def _host(self, host: str, now: float) -> _HostState:
+        if host not in self._hosts:
+            self._hosts[host] = _HostState(now)
+        return self._hosts[host]
+
+    def _account(self, account: str, now: float) -> _TokenBucket:
+        if account not in self._accounts:
+            self._accounts[account] = _TokenBucket(
+                _ACCOUNT_RATE, _ACCOUNT_CAPACITY, now
+            )
+        return self._accounts[account]
+
+    def try_acquire(self, host: str, account: str, priority: Priority) -> float:
+        """
+        takes a token and returns 0, or returns how long to wait before trying again
+        """
+        with self._lock:
+            now = self._clock()
+            host_state = self._host(host, now)
+            account_bucket = self._account(account, now)
+            delay = max(
+                host_state.bucket.delay(now, priority),
+                account_bucket.delay(now, priority),
+            )
+            if priority != Priority.BURST:
+                delay = max(delay, host_state.backoff_until - now)
+            if priority in _PREEMPTED_BY_BURST:
+                delay = max(delay, host_state.burst_until - now)
+            if delay > 0:
+                return min(delay, _MAX_WAIT_STEP)
+            host_state.bucket.take()
+            account_bucket.take()
+            if priority == Priority.BURST:
+                host_state.burst_until = now + _BURST_QUIET_PERIOD
+            self._metrics[host][f"requests.{priority.name.lower()}"] += 1
+            return 0.0
+
+    def _record_wait(self, host: str, waited: float):
+        if waited > 0:
+            with self._lock:
+                self._metrics[host]["throttled"] += 1
+                self._metrics[host]["throttled_seconds"] += waited
+
+    def acquire(self, host: str, account: str, priority: Priority):
+        waited = 0.0
+        while delay := self.try_acquire(host, account, priority):
+            time.sleep(delay)
+            waited += delay
+        self._record_wait(host, waited)
+
+    async def acquire_async(self, host: str, account: str, priority: Priority):
+        waited = 0.0
+        while delay := self.try_acquire(host, account, priority):
+            await asyncio.sleep(delay)
+            waited += delay
+        self._record_wait(host, waited)
+
+    def report(
+        self,
+        host: str,
+        status: int,
+        elapsed: float,
+        retry_after: Optional[str] = None,
+    ):
+        """
+        adapts the host rate to how the site copes: errors halve it and start a backoff
+        (honoring retry-after), slow responses trim it, healthy responses let it recover
+        """
+        with self._lock:
+            now = self._clock()
+            host_state = self._host(host, now)
+            metrics = self._metrics[host]
+            if status == 429 or status >= 500:
+                metrics["backoffs"] += 1
+                host_state.bucket.slow_down(0.5)
+                backoff = host_state.backoff
+                if retry_after is not None and retry_after.isdigit():
+                    backoff = min(float(retry_after), _MAX_BACKOFF)
+                host_state.backoff_until = max(host_state.backoff_until, now + backoff)
+                host_state.backoff = min(host_state.backoff * 2, _MAX_BACKOFF)
+            elif elapsed > _SLOW_RESPONSE:
+                metrics["slow_responses"] += 1
+                host_state.bucket.slow_down(0.75)
+            else:
+                host_state.bucket.recover()
+                host_state.backoff = _INITIAL_BACKOFF
+            metrics["current_rate"] = host_state.bucket.rate
+
+    def metrics(self) -> dict[str, dict[str, float]]:
+        with self._lock:
+            return {host: dict(values) for host, values in self._metrics.items()}
+
+
+governor = Governor()  # shared by every booking thread
@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+
+from governor import Governor, Priority, account_key, _HOST_CAPACITY, _HOST_RATE
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+@pytest.fixture
+def governor(clock) -> Governor:
+    return Governor(clock=clock)
+
+
+def _drain(governor: Governor, priority: Priority, account: str = "a") -> int:
+    taken = 0
+    while governor.try_acquire("host", account, priority) == 0:
+        taken += 1
+    return taken
+
+
+def test_burst_can_use_the_whole_host_bucket(governor):
+    # accounts are smaller than hosts, so spread the burst over several sessions
+    taken = sum(_drain(governor, Priority.BURST, account) for account in "abc")
+    assert taken == _HOST_CAPACITY
+
+
+def test_lower_priorities_leave_a_reserve(governor):
+    polling = _drain(governor, Priority.POLLING)
+    assert polling < _drain(Governor(), Priority.BOOKING)
+    # the burst still gets through once polling is throttled
+    assert governor.try_acquire("host", "b", Priority.BURST) == 0
+
+
+def test_tokens_refill_with_time(governor, clock):
+    _drain(governor, Priority.BOOKING)
+    assert governor.try_acquire("host", "a", Priority.BOOKING) > 0
+    clock.now += 1
+    assert governor.try_acquire("host", "a", Priority.BOOKING) == 0
+
+
+def test_burst_preempts_polling(governor, clock):
+    assert governor.try_acquire("host", "a", Priority.BURST) == 0
+    assert governor.try_acquire("host", "a", Priority.POLLING) > 0
+    assert governor.try_acquire("host", "a", Priority.BOOKING) == 0
+    clock.now += 1.5
+    assert governor.try_acquire("host", "a", Priority.POLLING) == 0
+
+
+def test_backoff_on_throttling(governor, clock):
+    governor.report("host", 429, elapsed=0.1, retry_after="2")
+    assert governor.try_acquire("host", "a", Priority.POLLING) > 0
+    assert governor.try_acquire("host", "a", Priority.BURST) == 0
+    clock.now += 2.5
+    assert governor.try_acquire("host", "a", Priority.POLLING) == 0
+    metrics = governor.metrics()["host"]
+    assert metrics["backoffs"] == 1
+    assert metrics["current_rate"] == _HOST_RATE / 2
+
+
+def test_rate_recovers_after_errors(governor):
+    governor.report("host", 503, elapsed=0.1)
+    governor.report("host", 200, elapsed=0.1)
+    assert governor.metrics()["host"]["current_rate"] == pytest.approx(_HOST_RATE * 0.6)
+
+
+def test_slow_responses_slow_down(governor):
+    governor.report("host", 200, elapsed=10)
+    metrics = governor.metrics()["host"]
+    assert metrics["slow_responses"] == 1
+    assert metrics["current_rate"] == _HOST_RATE * 0.75
+
+
+def test_acquire_async_waits_and_records_throttling():
+    governor = Governor()
+    governor.report("host", 429, elapsed=0.1, retry_after="0")
+    # second error, backoff doubled to a second
+    governor.report("host", 429, elapsed=0.1)
+    asyncio.run(governor.acquire_async("host", "a", Priority.POLLING))
+    metrics = governor.metrics()["host"]
+    assert metrics["throttled"] == 1
+    assert metrics["throttled_seconds"] > 0
+    assert metrics["requests.polling"] == 1
+
+
+def test_account_key_does_not_leak_the_username():
+    key = account_key("my-user")
+    assert "my-user" not in key
+    assert key == account_key("my-user")  # every session of the account
+    assert key != account_key("other-user")
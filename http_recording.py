@@ -0,0 +1,257 @@
+import asyncio
+import dataclasses
+import gzip
+import json
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from http_transport import HttpResponse, Transport
+
+_FORMAT = 1
+_REDACTED = "<redacted>"
+# shorter secrets are only redacted in form fields and cookies, scrubbing them out of
+# page text would mangle urls and markup
+_MIN_SCRUBBED_LENGTH = 4
+
+
+class ReplayMismatchError(Exception):
+    pass
+
+
+@dataclasses.dataclass
+class Exchange:
+    elapsed: float  # seconds until the response arrived
+    method: str
+    url: str
+    data: dict
+    status: int
+    headers: dict[str, str]
+    text: str
+    cookies: dict[str, str]
+
+    def response(self) -> HttpResponse:
+        return HttpResponse(
+            status=self.status,
+            headers=dict(self.headers),
+            text=self.text,
+            cookies=dict(self.cookies),
+        )
+
+
+@dataclasses.dataclass
+class Recording:
+    header: dict  # what was run: meeting time, room, booking time, profile
+    exchanges: list[Exchange]
+
+
+class Recorder:
+    """
+    keeps exchanges in memory while the run is on, so recording adds no disk io to the burst.
+    credentials are scrubbed when saving: values of the secret form fields and every cookie value
+    are redacted wherever they appear, and set-cookie headers are dropped
+    """
+
+    def __init__(self, header: dict, secret_fields: list[str]):
+        self.header = header
+        self._secret_fields = set(secret_fields)
+        self._secrets: set[str] = set()
+        self._exchanges: list[Exchange] = []
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        method: str,
+        url: str,
+        data: dict,
+        cookies: dict[str, str],
+        started: float,
+        response: HttpResponse,
+    ):
+        exchange = Exchange(
+            elapsed=time.monotonic() - started,
+            method=method,
+            url=url,
+            data=dict(data),
+            status=response.status,
+            headers=dict(response.headers),
+            text=response.text,
+            cookies=dict(response.cookies),
+        )
+        with self._lock:
+            self._secrets.update(cookies.values())
+            self._secrets.update(response.cookies.values())
+            self._secrets.update(
+                str(value)
+                for name, value in data.items()
+                if name in self._secret_fields
+            )
+            self._exchanges.append(exchange)
+
+    def _scrub(self, text: str, secrets: list[str]) -> str:
+        for secret in secrets:
+            text = text.replace(secret, _REDACTED)
+        for (
+            field
+        ) in self._secret_fields:  # secrets we never sent, like unused form tokens
+            text = re.sub(
+                rf'(name="{re.escape(field)}"[^>]*value=")[^"]*(")',
+                rf"\g<1>{_REDACTED}\g<2>",
+                text,
+            )
+        return text
+
+    def _redacted(self, exchange: Exchange, secrets: list[str]) -> Exchange:
+        return dataclasses.replace(
+            exchange,
+            url=self._scrub(exchange.url, secrets),
+            data={
+                name: _REDACTED if name in self._secret_fields else value
+                for name, value in exchange.data.items()
+            },
+            headers={
+                name: value
+                for name, value in exchange.headers.items()
+                if name != "set-cookie"
+            },
+            text=self._scrub(exchange.text, secrets),
+            cookies={name: _REDACTED for name in exchange.cookies},
+        )
+
+    def save(self, path: Path):
+        with self._lock:
+            exchanges = list(self._exchanges)
+            # longest first, so a secret containing another one is fully redacted
+            secrets = sorted(
+                (s for s in self._secrets if len(s) >= _MIN_SCRUBBED_LENGTH),
+                key=len,
+                reverse=True,
+            )
+        with gzip.open(path, "wt", encoding="utf-8") as file:
+            header = {"format": _FORMAT, **self.header}
+            file.write(json.dumps(header, ensure_ascii=False, separators=(",", ":")))
+            file.write("\n")
+            for exchange in exchanges:
+                redacted = dataclasses.asdict(self._redacted(exchange, secrets))
+                file.write(
+                    json.dumps(redacted, ensure_ascii=False, separators=(",", ":"))
+                )
+                file.write("\n")
+
+
+def load(path: Path) -> Recording:
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        header = json.loads(file.readline())
+        if header.pop("format") != _FORMAT:
+            raise ValueError(f"Unsupported recording format in {path}")
+        exchanges = [Exchange(**json.loads(line)) for line in file if line.strip()]
+    return Recording(header=header, exchanges=exchanges)
+
+
+class RecordingTransport:
+    def __init__(self, inner: Transport, recorder: Recorder):
+        self.inner = inner
+        self.recorder = recorder
+
+    def get(
+        self, url: str, headers: dict[str, str], cookies: dict[str, str]
+    ) -> HttpResponse:
+        started = time.monotonic()
+        response = self.inner.get(url, headers, cookies)
+        self.recorder.record("GET", url, {}, cookies, started, response)
+        return response
+
+    def post(
+        self, url: str, headers: dict[str, str], cookies: dict[str, str], data: dict
+    ) -> HttpResponse:
+        started = time.monotonic()
+        response = self.inner.post(url, headers, cookies, data)
+        self.recorder.record("POST", url, data, cookies, started, response)
+        return response
+
+    async def post_async(
+        self, url: str, headers: dict[str, str], cookies: dict[str, str], data: dict
+    ) -> HttpResponse:
+        started = time.monotonic()
+        response = await self.inner.post_async(url, headers, cookies, data)
+        self.recorder.record("POST", url, data, cookies, started, response)
+        return response
+
+
+def _shape(url: str) -> str:
+    """
+    urls holding the current date or time differ between the recording and the replay
+    """
+    return re.sub(r"\d+", "#", url)
+
+
+class ReplayTransport:
+    """
+    answers every request with the next matching recorded exchange, after the recorded latency.
+    an exchange matches on method and url, or on method and url shape when no url matches
+    """
+
+    def __init__(self, recording: Recording, speed: float = 1.0):
+        self._pending = list(recording.exchanges)
+        self._speed = speed
+        self._lock = threading.Lock()
+
+    def _take(self, method: str, url: str) -> Exchange:
+        with self._lock:
+            for matches in (
+                lambda exchange: exchange.url == url,
+                lambda exchange: _shape(exchange.url) == _shape(url),
+            ):
+                for exchange in self._pending:
+                    if exchange.method == method and matches(exchange):
+                        self._pending.remove(exchange)
+                        return exchange
+        raise ReplayMismatchError(f"No recorded exchange for {method} {url}")
+
+    def remaining(self) -> int:
+        return len(self._pending)
+
+    def get(
+        self, url: str, headers: dict[str, str], cookies: dict[str, str]
+    ) -> HttpResponse:
+        exchange = self._take("GET", url)
+        time.sleep(exchange.elapsed / self._speed)
+        return exchange.response()
+
+    def post(
+        self, url: str, headers: dict[str, str], cookies: dict[str, str], data: dict
+    ) -> HttpResponse:
+        exchange = self._take("POST", url)
+        time.sleep(exchange.elapsed / self._speed)
+        return exchange.response()
+
+    async def post_async(
+        self, url: str, headers: dict[str, str], cookies: dict[str, str], data: dict
+    ) -> HttpResponse:
+        exchange = self._take("POST", url)
+        await asyncio.sleep(exchange.elapsed / self._speed)
+        return exchange.response()
+
+
+def _main(argv: Optional[list[str]] = None):
+    import argparse
+    import logging
+    import sys
+
+    from schedule_room import replay_schedule_room
+
+    parser = argparse.ArgumentParser(
+        description="replay a recorded booking run against its recorded responses"
+    )
+    parser.add_argument("recording", type=Path)
+    args = parser.parse_args(argv)
+    logger = logging.getLogger("replay")
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+    print(replay_schedule_room(args.recording, logger))
+
+
+if __name__ == "__main__":
+    _main()
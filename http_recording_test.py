@@ -0,0 +1,95 @@
+import asyncio
+import gzip
+import logging
+from datetime import datetime
+
+import pytest
+
+from http_recording import (
+    Recorder,
+    RecordingTransport,
+    ReplayMismatchError,
+    ReplayTransport,
+    load,
+)
+from http_transport import HttpResponse
+from models import Credentials
+from visual_theater import book_room, query_session_creds
+
+logger = logging.getLogger()
+
+_TOKEN_PAGE = (
+    '<form><input type="hidden" name="form_token" value="secret-token" /></form>'
+)
+_BOOKED_PAGE = '<div class="alert-dismissible">הזמנה של my-user נוצר.</div>'
+
+
+class FakeSiteTransport:
+    def get(self, url, headers, cookies):
+        return HttpResponse(200, {}, _TOKEN_PAGE, dict(cookies))
+
+    def post(self, url, headers, cookies, data):
+        return HttpResponse(
+            302, {"set-cookie": "SESS1=session-id"}, "", {"SESS1": "session-id"}
+        )
+
+    async def post_async(self, url, headers, cookies, data):
+        return HttpResponse(200, {}, _BOOKED_PAGE, dict(cookies))
+
+
+@pytest.fixture
+def recorder() -> Recorder:
+    return Recorder(
+        header={"room": "14343"}, secret_fields=["name", "pass", "form_token"]
+    )
+
+
+def _run_booking(transport) -> bool:
+    creds = query_session_creds(
+        Credentials(username="my-user", password="my-pass"), transport=transport
+    )
+    return asyncio.run(
+        book_room(creds, datetime(2024, 5, 26, 8, 0), "14343", logger, sender=transport)
+    )
+
+
+def test_recording_is_redacted(recorder, tmp_path):
+    assert _run_booking(RecordingTransport(FakeSiteTransport(), recorder))
+    path = tmp_path / "run.jsonl.gz"
+    recorder.save(path)
+
+    raw = gzip.open(path, "rt", encoding="utf-8").read()
+    for secret in ("my-user", "my-pass", "session-id", "secret-token"):
+        assert secret not in raw
+
+    recording = load(path)
+    assert recording.header == {"room": "14343"}
+    assert [exchange.method for exchange in recording.exchanges] == [
+        "POST",
+        "GET",
+        "POST",
+    ]
+    login = recording.exchanges[0]
+    assert login.data["name"] == "<redacted>"
+    assert login.cookies == {"SESS1": "<redacted>"}
+    assert "set-cookie" not in login.headers
+
+
+def test_replay_answers_with_recorded_responses(recorder, tmp_path):
+    _run_booking(RecordingTransport(FakeSiteTransport(), recorder))
+    path = tmp_path / "run.jsonl.gz"
+    recorder.save(path)
+
+    replay = ReplayTransport(load(path), speed=1000)
+    # the form token page url holds the current time, it is matched by shape
+    assert _run_booking(replay)
+    assert replay.remaining() == 0
+    with pytest.raises(ReplayMismatchError):
+        replay.get("https://students.visualtheatre.co.il/he", {}, {})
+
+
+def test_recording_keeps_to_its_own_requests(recorder):
+    recording = RecordingTransport(FakeSiteTransport(), recorder)
+    _run_booking(recording)
+    _run_booking(FakeSiteTransport())  # another run at the same time
+    assert len(recorder._exchanges) == 3
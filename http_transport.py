@@ -0,0 +1,101 @@
+import dataclasses
+import ssl
+import threading
+from typing import Optional, Protocol
+
+import aiohttp
+import certifi
+import requests
+
+
+@dataclasses.dataclass
+class HttpResponse:
+    status: int
+    headers: dict[str, str]  # lower case names
+    text: str
+    cookies: dict[str, str]  # cookies held after the exchange, including redirects
+
+
+class Transport(Protocol):
+    def get(
+        self, url: str, headers: dict[str, str], cookies: dict[str, str]
+    ) -> HttpResponse: ...
+
+    def post(
+        self, url: str, headers: dict[str, str], cookies: dict[str, str], data: dict
+    ) -> HttpResponse: ...
+
+    async def post_async(
+        self, url: str, headers: dict[str, str], cookies: dict[str, str], data: dict
+    ) -> HttpResponse: ...
+
+
+def _lower(headers) -> dict[str, str]:
+    return {name.lower(): value for name, value in headers.items()}
+
+
+_ssl_context: Optional[ssl.SSLContext] = None
+_ssl_context_lock = threading.Lock()
+
+
+def ssl_context() -> ssl.SSLContext:
+    """
+    the context the async clients verify the site with, against certifi's roots like requests.
+    building one loads every root certificate, so it is built once, by arm, and shared
+    """
+    global _ssl_context
+    with _ssl_context_lock:
+        if _ssl_context is None:
+            _ssl_context = ssl.create_default_context(cafile=certifi.where())
+        return _ssl_context
+
+
+class LiveTransport:
+    """
+    talks to the site: requests for the blocking calls, aiohttp for the burst
+    """
+
+    def get(
+        self, url: str, headers: dict[str, str], cookies: dict[str, str]
+    ) -> HttpResponse:
+        response = requests.get(url, headers=headers, cookies=cookies)
+        return HttpResponse(
+            status=response.status_code,
+            headers=_lower(response.headers),
+            text=response.text,
+            cookies={**cookies, **response.cookies.get_dict()},
+        )
+
+    def post(
+        self, url: str, headers: dict[str, str], cookies: dict[str, str], data: dict
+    ) -> HttpResponse:
+        session = requests.Session()
+        session.cookies.update(cookies)
+        response = session.post(url, headers=headers, data=data)
+        return HttpResponse(
+            status=response.status_code,
+            headers=_lower(response.headers),
+            text=response.text,
+            cookies=session.cookies.get_dict(),
+        )
+
+    async def post_async(
+        self, url: str, headers: dict[str, str], cookies: dict[str, str], data: dict
+    ) -> HttpResponse:
+        async with aiohttp.ClientSession() as session:
+            async with session.post(
+                url,
+                headers=headers,
+                cookies=cookies,
+                data=data,
+                ssl=ssl_context(),
+            ) as response:
+                return HttpResponse(
+                    status=response.status,
+                    headers=_lower(response.headers),
+                    text=await response.text(),
+                    cookies={
+                        **cookies,
+                        **{name: c.value for name, c in response.cookies.items()},
+                    },
+                )
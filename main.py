@@ -1,11 +1,42 @@
+import time
+
+_IMPORT_STARTED = time.perf_counter()
+
+import contextlib
+import functools
+import hashlib
 import json
 import logging
 import sys
-from fastapi import FastAPI, Request, Form
+import threading
+from typing import Optional
+from fastapi import FastAPI, Request, Form, HTTPException, Response
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 
-app = FastAPI()
+from timing_report import TimingReport
+
+_startup_timing = TimingReport("startup")
+
+
+def _warm_up():
+    _room_catalog()  # load the cached catalog
+    _booking()
+    _startup_timing.log(logger)
+
+
+@contextlib.asynccontextmanager
+async def _lifespan(app: FastAPI):
+    # not at import time, parse pool workers import this module too.
+    # the server accepts requests right away, a request needing the booking engine
+    # before the warm up is done waits for its import
+    with _startup_timing.measure("compile_site_profile"):
+        active_profile()  # compiled once, before any request or booking thread needs it
+    threading.Thread(target=_warm_up, name="WarmUp", daemon=True).start()
+    yield
+
+
+app = FastAPI(lifespan=_lifespan)
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 stream_handler = logging.StreamHandler(sys.stdout)
@@ -18,17 +49,12 @@ logger.addHandler(stream_handler)
 logger.info("API is starting up")
 
 
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 
 
-from schedule_room import (
-    start_booking_process,
-    real_get_status,
-    set_settings,
-    get_send_booking_time, get_alternative_bookings,
-)
 from models import ScheduleRoomCommand, Credentials
-
+import room_catalog
+from site_profile import active_profile
 
 templates = Jinja2Templates(directory="templates")
 
@@ -43,43 +69,79 @@ def _time_slots() -> list[str]:
     return time_slots
 
 
-def _date_slots() -> list[str]:
+_TIME_SLOTS = _time_slots()  # never changes
+
+
+@functools.lru_cache(maxsize=2)
+def _date_slots(today: date) -> list[str]:
     date_slots = []
     for i in range(0, 18):
-        date_slots.append((datetime.now() + timedelta(days=i)).strftime("%Y-%m-%d"))
+        date_slots.append((today + timedelta(days=i)).strftime("%Y-%m-%d"))
     # from latest to oldest
     date_slots.sort(reverse=True)
     return date_slots
 
 
-_ROOMS_TO_IDS = {
-    "חדר תפירה- סטודיו נקי": "14349",
-    "ביהס למוזיקה מן המזרח": "123666",
-    "תיאטרון סופר מריו": "14348",
-    "האולם הלבן": "14343",
-    "כיתה 2": "14351",
-    "יד חרוצים": "14347",
-    "אולפן": "14350",
-}
-
-
-def _landing_page(request: Request):
-    return templates.TemplateResponse(
-        request,
-        _INDEX_FILE_PATH,
-        context={
-            "time_slots": _time_slots(),
-            "date_slots": _date_slots(),
-            "rooms": _ROOMS_TO_IDS,
-            "start_at": get_send_booking_time().strftime("%H:%M"),
-            "alternative_booking_enabled": get_alternative_bookings()
-        },
+def _booking():
+    """
+    schedule_room pulls in the http clients and the parser, it is imported on first use
+    """
+    with _startup_timing.measure("import_schedule_room"):
+        import schedule_room
+    return schedule_room
+
+
+def _room_catalog() -> room_catalog.RoomCatalog:
+    """
+    the room list needs a logged in session to fetch, so it is only refreshed by bookings
+    """
+    with _startup_timing.measure("load_room_catalog"):
+        return room_catalog.catalog()
+
+
+# (key, body, etag) of the last rendered landing page, the key is
+# (date, settings version, room catalog version) so a new day, new settings
+# or a new room list render it again
+_landing_page_cache: Optional[tuple[tuple, bytes, str]] = None
+
+
+def _render_landing_page(catalog: room_catalog.RoomCatalog, today: date) -> bytes:
+    booking = _booking()
+    return (
+        templates.get_template(_INDEX_FILE_PATH)
+        .render(
+            time_slots=_TIME_SLOTS,
+            date_slots=_date_slots(today),
+            rooms=catalog.rooms,
+            start_at=booking.get_send_booking_time().strftime("%H:%M"),
+            alternative_booking_enabled=booking.get_alternative_bookings(),
+        )
+        .encode("utf-8")
     )
 
 
+def _landing_page() -> tuple[bytes, str]:
+    global _landing_page_cache
+    catalog = _room_catalog()
+    today = date.today()
+    key = (today, _booking().get_settings_version(), catalog.version)
+    cached = _landing_page_cache
+    if cached is not None and cached[0] == key:
+        return cached[1], cached[2]
+    body = _render_landing_page(catalog, today)
+    etag = f'"{hashlib.sha1(body).hexdigest()[:16]}"'
+    _landing_page_cache = (key, body, etag)
+    return body, etag
+
+
 @app.get("/", response_class=HTMLResponse)
 async def get_form(request: Request):
-    return _landing_page(request)
+    body, etag = _landing_page()
+    # no-cache: browsers keep the page but revalidate it on every load
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(content=body, headers=headers)
 
 
 @app.post("/book_meeting", response_class=HTMLResponse)
@@ -93,19 +155,26 @@ async def schedule_room(
 ):
     time = datetime.strptime(f"{meeting_date} {meeting_time}", "%Y-%m-%d %H:%M")
     assert time.minute in [0, 30]  # only on the hour or half hour
+    if not _room_catalog().has_room(room):
+        raise HTTPException(status_code=400, detail=f"Unknown room {room}")
     meeting = ScheduleRoomCommand(
         time=time,
         room=room,
         credentials=Credentials(username=username, password=password),
     )
-    start_booking_process(meeting, logger)
+    _booking().start_booking_process(meeting, logger)
     return RedirectResponse(url="/", status_code=303)
 
 
+@functools.lru_cache(maxsize=None)
+def _status_body(status: str) -> bytes:
+    return json.dumps({"status": status}).encode("utf-8")
+
+
 @app.get("/get_status", response_class=HTMLResponse)
 async def get_status(request: Request):
-    status = real_get_status()
-    return json.dumps({"status": status})
+    # there is a handful of statuses, their bodies are encoded once
+    return HTMLResponse(content=_status_body(_booking().real_get_status()))
 
 
 @app.post("/settings", response_class=HTMLResponse)
@@ -114,13 +183,16 @@ async def settings_landing(
     start_booking_at: str = Form(...),
     alternative_booking_enabled: bool = Form(False),
 ):
-    set_settings(
+    _booking().set_settings(
         start_booking_at=datetime.strptime(start_booking_at, "%H:%M"),
         alternative_booking=alternative_booking_enabled,
     )
     return RedirectResponse(url="/", status_code=303)
 
 
+_startup_timing.record("import_main", time.perf_counter() - _IMPORT_STARTED)
+
+
 if __name__ == "__main__":
     import uvicorn
 
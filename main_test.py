@@ -0,0 +1,90 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+# imported on first use, or by the warm up thread once the server is up
+_DEFERRED_MODULES = [
+    "aiohttp",
+    "bs4",
+    "requests",
+    "schedule_room",
+    "visual_theater",
+]
+# seconds, about four times what importing the web front takes here
+_IMPORT_BUDGET = 1.5
+
+
+def test_importing_the_web_front_defers_the_booking_engine():
+    code = (
+        "import sys, main\n"
+        f"print([name for name in {_DEFERRED_MODULES!r} if name in sys.modules])\n"
+        "print(main._startup_timing.timings()['import_main'])"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=Path(__file__).parent,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    loaded, import_seconds = result.stdout.strip().splitlines()[-2:]
+    assert loaded == "[]"
+    assert 0 < float(import_seconds) < _IMPORT_BUDGET
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    pytest.importorskip("httpx")  # needed by the test client
+    from fastapi.testclient import TestClient
+
+    import main
+    import room_catalog
+    import schedule_room
+
+    # settings posted by a test are restored afterwards
+    for name in ("_SEND_BOOKING_TIME", "_ALTERNATIVE_BOOKING_ENABLED"):
+        monkeypatch.setattr(schedule_room, name, getattr(schedule_room, name))
+    monkeypatch.setenv("ROOM_CATALOG_PATH", str(tmp_path / "room_catalog.json"))
+    monkeypatch.setattr(room_catalog, "_catalog", None)
+    monkeypatch.setattr(main, "_landing_page_cache", None)
+    return TestClient(main.app)
+
+
+def test_landing_page_is_revalidated_with_etag(client):
+    response = client.get("/")
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    assert "האולם הלבן" in response.text
+
+    response = client.get("/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+
+
+def test_landing_page_changes_with_settings(client):
+    etag = client.get("/").headers["etag"]
+    client.post(
+        "/settings",
+        data={"start_booking_at": "09:30", "alternative_booking_enabled": "True"},
+        follow_redirects=False,
+    )
+    response = client.get("/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert "Booking will start at 09:30" in response.text
+
+
+def test_get_status(client):
+    assert client.get("/get_status").json() == {"status": "idle"}
+
+
+def test_site_profile_is_compiled_at_startup(client, monkeypatch):
+    import main
+    import site_profile
+
+    monkeypatch.setattr(site_profile, "_active_profile", None)
+    with client:  # runs the lifespan
+        assert site_profile._active_profile is not None
+    assert "compile_site_profile" in main._startup_timing.timings()
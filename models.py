@@ -18,6 +18,7 @@ FormToken = NewType("FormToken", str)
 class SessionCredentials(BaseModel):
     cookie: SessionCookie
     form_token: FormToken
+    account: str  # governor.account_key of the username the session belongs to
 
 
 @dataclasses.dataclass
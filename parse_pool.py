@@ -0,0 +1,166 @@
+import asyncio
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import threading
+import weakref
+from datetime import datetime
+from typing import Optional
+
+from models import Room
+from site_profile import SiteProfile, SiteProfileConfig, active_profile, compile_profile
+
+_WORKERS = min(os.cpu_count() or 1, 4)
+_QUEUED_PER_WORKER = 2  # pages waiting per worker before callers have to wait
+_WARM_UP_PAGE = (
+    '<div id="halls"><div class="grid-column hours-column">'
+    '<ul><li class="room-info"><a href="/he/node/1">room</a></li></ul></div></div>'
+)
+
+# a compact room: name, id and (month, day, hour, minute) per available slot
+CompactRoom = tuple[str, str, list[tuple[int, int, int, int]]]
+
+
+class _ErrorCollector(logging.Handler):
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.messages: list[str] = []
+
+    def emit(self, record: logging.LogRecord):
+        self.messages.append(record.getMessage())
+
+
+_worker_logger = logging.getLogger("parse_pool.worker")
+_worker_errors = _ErrorCollector()
+
+
+_worker_profiles: dict[str, SiteProfile] = {}  # compiled once per worker, by config
+
+
+def _worker_init(config: SiteProfileConfig):
+    """
+    runs once per worker process: pays for the imports and the first parse before any real page
+    """
+    _worker_logger.addHandler(_worker_errors)
+    _worker_logger.propagate = False
+    _parse_compact(_WARM_UP_PAGE, config)
+
+
+def _worker_profile(config: SiteProfileConfig) -> SiteProfile:
+    key = config.model_dump_json()
+    if key not in _worker_profiles:
+        _worker_profiles[key] = compile_profile(config)
+    return _worker_profiles[key]
+
+
+def _parse_compact(
+    html: str, config: SiteProfileConfig
+) -> tuple[list[CompactRoom], list[str]]:
+    """
+    runs in a worker. tuples pickle much faster than rooms holding datetimes,
+    errors are sent back to be logged by the caller
+    """
+    from visual_theater import _parse_rooms
+
+    profile = _worker_profile(config)
+    _worker_errors.messages = []
+    rooms = [
+        (
+            room.name,
+            room.id,
+            [
+                (slot.month, slot.day, slot.hour, slot.minute)
+                for slot in room.available_slots
+            ],
+        )
+        for room in _parse_rooms(html, _worker_logger, profile)
+    ]
+    return rooms, _worker_errors.messages
+
+
+def _expand(rooms: list[CompactRoom]) -> list[Room]:
+    return [
+        Room(
+            name=name,
+            id=room_id,
+            available_slots=[
+                datetime(year=1, month=month, day=day, hour=hour, minute=minute)
+                for month, day, hour, minute in slots
+            ],
+        )
+        for name, room_id, slots in rooms
+    ]
+
+
+class ParsePool:
+    """
+    parses reservation pages in worker processes so the event loop driving the bookings
+    never blocks on building a soup. at most workers * _QUEUED_PER_WORKER pages are in flight,
+    more callers wait their turn on the loop instead of piling pages into the pool
+    """
+
+    def __init__(self, workers: int = _WORKERS):
+        self.workers = workers
+        self._executor: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        # every asyncio.run has its own loop and a semaphore belongs to one loop
+        self._slots: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, asyncio.Semaphore
+        ] = weakref.WeakKeyDictionary()
+
+    def start(self):
+        """
+        forks every worker and waits for them to warm up on the active profile,
+        safe to call more than once
+        """
+        with self._lock:
+            if self._executor is not None:
+                return
+            config = active_profile().config
+            # spawn, not fork: booking threads may be running while the pool starts
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_worker_init,
+                initargs=(config,),
+            )
+            warm_ups = [
+                self._executor.submit(_parse_compact, _WARM_UP_PAGE, config)
+                for _ in range(self.workers)
+            ]
+            concurrent.futures.wait(warm_ups)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+            self._slots.clear()
+
+    def _slots_for(self, loop: asyncio.AbstractEventLoop) -> asyncio.Semaphore:
+        with self._lock:
+            if loop not in self._slots:
+                self._slots[loop] = asyncio.Semaphore(self.workers * _QUEUED_PER_WORKER)
+            return self._slots[loop]
+
+    async def parse_rooms(
+        self,
+        html: str,
+        logger: logging.Logger,
+        profile: Optional[SiteProfile] = None,
+    ) -> list[Room]:
+        config = (profile or active_profile()).config
+        if self._executor is None:
+            await asyncio.to_thread(self.start)
+        loop = asyncio.get_running_loop()
+        async with self._slots_for(loop):
+            rooms, errors = await loop.run_in_executor(
+                self._executor, _parse_compact, html, config
+            )
+        for error in errors:
+            logger.error(error)
+        return _expand(rooms)
+
+
+parse_pool = ParsePool()  # shared by every booking thread
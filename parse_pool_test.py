@@ -0,0 +1,67 @@
+import asyncio
+import logging
+
+import pytest
+
+from parse_pool import ParsePool
+from site_profile import active_profile, compile_profile
+from visual_theater import _parse_rooms
+from visual_theater_test import _MY_RESPONSE
+
+logger = logging.getLogger()
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = ParsePool(workers=2)
+    pool.start()
+    yield pool
+    pool.shutdown()
+
+
+def test_pool_matches_inline_parsing(pool):
+    rooms = asyncio.run(pool.parse_rooms(_MY_RESPONSE, logger))
+    assert rooms == list(_parse_rooms(_MY_RESPONSE, logger))
+
+
+def test_pool_serves_several_loops(pool):
+    # every booking thread runs its own asyncio.run
+    for _ in range(2):
+        assert asyncio.run(pool.parse_rooms(_MY_RESPONSE, logger))
+
+
+def test_concurrent_pages(pool):
+    async def scan():
+        return await asyncio.gather(
+            *(pool.parse_rooms(_MY_RESPONSE, logger) for _ in range(6))
+        )
+
+    results = asyncio.run(scan())
+    assert all(rooms == results[0] for rooms in results)
+
+
+def test_worker_errors_are_logged_by_the_caller(pool, caplog):
+    page = (
+        '<div id="halls"><div class="grid-column hours-column"><ul>'
+        '<li class="room-info"><a href="/he/node/7">room</a></li>'
+        '<li class="mystery"></li></ul></div></div>'
+    )
+    with caplog.at_level(logging.ERROR):
+        rooms = asyncio.run(pool.parse_rooms(page, logger))
+    assert [room.id for room in rooms] == ["7"]
+    assert "Unknown slot status" in caplog.text
+
+
+def test_pages_are_parsed_with_the_callers_profile(pool):
+    profile = active_profile()
+    config = profile.config.model_copy(
+        update={
+            "selectors": profile.config.selectors.model_copy(
+                update={"halls": "#other-halls"}
+            )
+        }
+    )
+    page = _MY_RESPONSE.replace('id="halls"', 'id="other-halls"')
+    rooms = asyncio.run(pool.parse_rooms(page, logger, compile_profile(config)))
+    assert rooms == list(_parse_rooms(_MY_RESPONSE, logger))
+    assert asyncio.run(pool.parse_rooms(page, logger)) == []
@@ -0,0 +1,301 @@
+import asyncio
+import collections
+import re
+import urllib.parse
+from http.cookies import SimpleCookie
+from typing import Optional
+
+from http_transport import HttpResponse, ssl_context
+from site_profile import SiteProfile
+
+_CONNECTIONS = 4
+_MAX_REDIRECTS = 5
+_RESENDS = 2  # times a request goes out again after its connection broke under it
+_REDIRECTS = frozenset({301, 302, 303, 307, 308})
+# selectors the scanner understands: a tag with classes, like div.messages.error
+_SIMPLE_SELECTOR = re.compile(r"^([a-zA-Z][a-zA-Z0-9]*)((?:\.[\w-]+)+)$")
+_CLASS_ATTRIBUTE = re.compile(r"""\bclass\s*=\s*(?:"([^"]*)"|'([^']*)')""")
+
+
+class _MessageScanner:
+    """
+    finds the message block without building a soup: the first element matching one of
+    the profile's message selectors, in selector order. None when a selector is beyond it
+    """
+
+    def __init__(self, selectors: list[str]):
+        self._blocks: list[tuple[str, frozenset[str], re.Pattern]] = []
+        for selector in selectors:
+            match = _SIMPLE_SELECTOR.match(selector)
+            if match is None:
+                raise ValueError(f"selector too complex to scan: {selector}")
+            tag = match.group(1).lower()
+            classes = frozenset(match.group(2).strip(".").split("."))
+            self._blocks.append((tag, classes, re.compile(rf"<{tag}\b[^>]*>", re.I)))
+
+    @classmethod
+    def for_profile(cls, profile: SiteProfile) -> Optional["_MessageScanner"]:
+        try:
+            return cls([selector.pattern for selector in profile.messages])
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _element_end(page: str, tag: str, start: int) -> int:
+        depth = 1
+        tags = re.compile(rf"<(/?){tag}\b[^>]*>", re.I)
+        for match in tags.finditer(page, start):
+            depth += -1 if match.group(1) else 1
+            if depth == 0:
+                return match.end()
+        return len(page)
+
+    def scan(self, page: str) -> Optional[str]:
+        for tag, classes, opening in self._blocks:
+            for match in opening.finditer(page):
+                attribute = _CLASS_ATTRIBUTE.search(match.group(0))
+                if attribute is None:
+                    continue
+                element_classes = (attribute.group(1) or attribute.group(2)).split()
+                if classes.issubset(element_classes):
+                    return page[
+                        match.start() : self._element_end(page, tag, match.end())
+                    ]
+        return None
+
+
+async def _read_response(
+    reader: asyncio.StreamReader,
+) -> tuple[int, dict[str, str], list[str], bytes, bool]:
+    """
+    status, headers (lower case, last one wins), set-cookie values, body, keep alive
+    """
+    version, status, *_ = (await reader.readuntil(b"\r\n")).split(b" ", 2)
+    headers, set_cookies = {}, []
+    while (line := await reader.readuntil(b"\r\n")) != b"\r\n":
+        name, _, value = line.decode("latin-1").partition(":")
+        name, value = name.strip().lower(), value.strip()
+        if name == "set-cookie":
+            set_cookies.append(value)
+        headers[name] = value
+    status = int(status)
+    if status in (204, 304) or 100 <= status < 200:
+        body = b""
+    elif headers.get("transfer-encoding", "").lower() == "chunked":
+        chunks = []
+        while size := int((await reader.readuntil(b"\r\n")).split(b";")[0], 16):
+            chunks.append((await reader.readexactly(size + 2))[:-2])
+        while await reader.readuntil(b"\r\n") != b"\r\n":  # trailers
+            pass
+        body = b"".join(chunks)
+    elif "content-length" in headers:
+        body = await reader.readexactly(int(headers["content-length"]))
+    else:
+        body = await reader.read()
+        headers["connection"] = "close"  # the body ended with the connection
+    keep_alive = (
+        version == b"HTTP/1.1" and headers.get("connection", "").lower() != "close"
+    )
+    return status, headers, set_cookies, body, keep_alive
+
+
+class _Unprocessed(ConnectionResetError):
+    """
+    the request was pipelined behind a response closing the connection,
+    the server never handled it so sending it again is always safe
+    """
+
+
+class _Connection:
+    """
+    one pipelined connection: requests are written as they come,
+    responses arrive in the same order and resolve the oldest waiting future
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.pending: collections.deque[asyncio.Future] = collections.deque()
+        self.open = True
+        self._reader_task = asyncio.create_task(self._read(reader))
+
+    def send(self, request: bytes) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append(future)
+        self.writer.write(request)
+        return future
+
+    async def _read(self, reader: asyncio.StreamReader):
+        error = ConnectionResetError("connection closed")
+        try:
+            while self.open:
+                response = await _read_response(reader)
+                future = self.pending.popleft()
+                if not future.done():
+                    future.set_result(response)
+                if not response[-1]:
+                    error = _Unprocessed("connection closed by the previous response")
+                    break
+        except (asyncio.IncompleteReadError, OSError, ValueError, IndexError):
+            pass
+        finally:
+            self.open = False
+            while self.pending:
+                future = self.pending.popleft()
+                if not future.done():
+                    future.set_exception(error)
+            self.writer.close()
+
+    async def close(self):
+        self.open = False
+        self.writer.close()
+        self._reader_task.cancel()
+        await asyncio.gather(self._reader_task, return_exceptions=True)
+
+
+class RawSender:
+    """
+    a minimal http/1.1 client for the burst: connections are opened up front, the request
+    bytes are serialized once while the burst repeats the same post, and every attempt is a
+    single write to the least busy connection. of the response only the message block is
+    kept, so the booking check parses a few hundred bytes instead of the whole page.
+    redirects are followed on the same connections. only post_async is offered
+    """
+
+    def __init__(
+        self,
+        url: str,
+        profile: SiteProfile,
+        addresses: Optional[list[str]] = None,
+        connections: int = _CONNECTIONS,
+    ):
+        parts = urllib.parse.urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self._host_header = parts.netloc
+        self._ssl = ssl_context() if parts.scheme == "https" else None
+        # connecting to an address directly keeps the host name for tls
+        self.addresses = addresses or [self.host]
+        self.connections = connections
+        self._scanner = _MessageScanner.for_profile(profile)
+        self._pool: list[_Connection] = []
+        self._reconnecting = asyncio.Lock()
+        self._serialized: Optional[tuple[tuple, bytes]] = None
+
+    async def __aenter__(self) -> "RawSender":
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _connect(self, index: int) -> _Connection:
+        reader, writer = await asyncio.open_connection(
+            self.addresses[index % len(self.addresses)],
+            self.port,
+            ssl=self._ssl,
+            server_hostname=self.host if self._ssl else None,
+        )
+        return _Connection(reader, writer)
+
+    async def open(self):
+        opened = await asyncio.gather(
+            *(self._connect(i) for i in range(self.connections)),
+            return_exceptions=True,
+        )
+        self._pool = [c for c in opened if isinstance(c, _Connection)]
+        for error in opened:
+            if isinstance(error, BaseException):
+                await self.close()
+                raise error
+
+    async def close(self):
+        await asyncio.gather(*(connection.close() for connection in self._pool))
+        self._pool = []
+
+    async def _connection(self) -> _Connection:
+        async with self._reconnecting:  # attempts failed together reconnect once
+            for index, connection in enumerate(self._pool):
+                if not connection.open:
+                    self._pool[index] = await self._connect(index)
+        return min(self._pool, key=lambda connection: len(connection.pending))
+
+    def _request(
+        self,
+        method: str,
+        target: str,
+        headers: dict[str, str],
+        cookies: dict[str, str],
+        body: bytes = b"",
+    ) -> bytes:
+        lines = [f"{method} {target} HTTP/1.1", f"Host: {self._host_header}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        if cookies:
+            lines.append(
+                "Cookie: "
+                + "; ".join(f"{name}={value}" for name, value in cookies.items())
+            )
+        if method == "POST":
+            lines.append("Content-Type: application/x-www-form-urlencoded")
+            lines.append(f"Content-Length: {len(body)}")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+    def _post_request(
+        self, url: str, headers: dict[str, str], cookies: dict[str, str], data: dict
+    ) -> bytes:
+        key = (url, tuple(headers.items()), tuple(cookies.items()), tuple(data.items()))
+        if self._serialized is None or self._serialized[0] != key:
+            parts = urllib.parse.urlsplit(url)
+            target = parts.path + (f"?{parts.query}" if parts.query else "")
+            body = urllib.parse.urlencode(data).encode("ascii")
+            self._serialized = (
+                key,
+                self._request("POST", target, headers, cookies, body),
+            )
+        return self._serialized[1]
+
+    async def _exchange(self, request: bytes) -> tuple:
+        """
+        a request lost to a connection the server closed is sent again on a fresh one.
+        an unprocessed request does not use up a resend: every new connection answers
+        at least its first request, so those always get through
+        """
+        resends = 0
+        while True:
+            try:
+                return await (await self._connection()).send(request)
+            except _Unprocessed:
+                pass
+            except ConnectionResetError:
+                if resends == _RESENDS:
+                    raise
+                resends += 1
+
+    async def post_async(
+        self, url: str, headers: dict[str, str], cookies: dict[str, str], data: dict
+    ) -> HttpResponse:
+        cookies = dict(cookies)
+        request = self._post_request(url, headers, cookies, data)
+        for _ in range(_MAX_REDIRECTS + 1):
+            status, response_headers, set_cookies, body, _ = await self._exchange(
+                request
+            )
+            for value in set_cookies:
+                cookies.update(
+                    {name: morsel.value for name, morsel in SimpleCookie(value).items()}
+                )
+            if status not in _REDIRECTS or "location" not in response_headers:
+                break
+            location = urllib.parse.urlsplit(
+                urllib.parse.urljoin(url, response_headers["location"])
+            )
+            url = location.geturl()
+            target = location.path + (f"?{location.query}" if location.query else "")
+            request = self._request("GET", target, headers, cookies)
+        page = body.decode("utf-8", errors="replace")
+        block = self._scanner.scan(page) if self._scanner else None
+        return HttpResponse(
+            status=status,
+            headers=response_headers,
+            text=page if block is None else block,
+            cookies=cookies,
+        )
@@ -0,0 +1,168 @@
+import asyncio
+import dataclasses
+import logging
+from datetime import datetime
+
+import soupsieve
+from aiohttp import web
+
+from conftest import BOOKED_PAGE
+from http_transport import ssl_context
+from models import FormToken, SessionCookie, SessionCredentials
+from raw_sender import RawSender, _MessageScanner
+from site_profile import _DEFAULT_PROFILE_PATH, load_profile
+from visual_theater import book_room
+
+logger = logging.getLogger()
+
+_PROFILE = load_profile(_DEFAULT_PROFILE_PATH)
+
+
+def test_scanner_finds_the_first_matching_selector():
+    scanner = _MessageScanner(["div.alert-dismissible", "div.messages.error"])
+    page = (
+        '<div class="error messages">wrong password</div>'
+        '<div class="alert-dismissible"><div>inner</div>created</div><div>after</div>'
+    )
+    assert (
+        scanner.scan(page)
+        == '<div class="alert-dismissible"><div>inner</div>created</div>'
+    )
+    assert scanner.scan(page[: page.index('<div class="alert')]) == (
+        '<div class="error messages">wrong password</div>'
+    )
+    assert scanner.scan("<p>nothing</p>") is None
+
+
+def test_profile_with_complex_selectors_is_not_scanned():
+    assert _MessageScanner.for_profile(_PROFILE) is not None
+    profile = dataclasses.replace(
+        _PROFILE, messages=(soupsieve.compile("#main > .status"),)
+    )
+    assert _MessageScanner.for_profile(profile) is None
+
+
+def test_senders_share_one_ssl_context():
+    senders = [RawSender("https://site.test/he", _PROFILE) for _ in range(2)]
+    assert all(sender._ssl is ssl_context() for sender in senders)
+
+
+def test_pipelined_responses_match_their_requests(stand_in_site):
+    received = []
+
+    async def echo(request: web.Request) -> web.Response:
+        number = (await request.post())["n"]
+        received.append(request.headers["cookie"])
+        await asyncio.sleep(0.01 * (int(number) % 3))
+        return web.Response(text=f'<div class="alert-dismissible">{number}</div>')
+
+    routes = web.RouteTableDef()
+    routes.post("/book")(echo)
+    base_url = stand_in_site(routes).url
+
+    async def main():
+        async with RawSender(base_url, _PROFILE, connections=2) as sender:
+            return await asyncio.gather(
+                *(
+                    sender.post_async(
+                        f"{base_url}/book", {"user-agent": ""}, {"S": "1"}, {"n": n}
+                    )
+                    for n in range(10)
+                )
+            )
+
+    responses = asyncio.run(main())
+    assert [response.text for response in responses] == [
+        f'<div class="alert-dismissible">{n}</div>' for n in range(10)
+    ]
+    assert received == ["S=1"] * 10
+
+
+def test_chunked_redirect_and_cookies(stand_in_site):
+    async def book(request: web.Request) -> web.Response:
+        await request.post()
+        raise web.HTTPSeeOther(
+            "/node/1", headers={"Set-Cookie": "flash=created; Path=/"}
+        )
+
+    async def node(request: web.Request) -> web.StreamResponse:
+        assert request.cookies == {"S": "1", "flash": "created"}
+        response = web.StreamResponse()
+        response.enable_chunked_encoding()
+        response.content_type = "text/html"
+        await response.prepare(request)
+        for part in range(0, len(BOOKED_PAGE), 40):
+            await response.write(BOOKED_PAGE[part : part + 40].encode("utf-8"))
+        await response.write_eof()
+        return response
+
+    routes = web.RouteTableDef()
+    routes.post("/book")(book)
+    routes.get("/node/1")(node)
+    base_url = stand_in_site(routes).url
+
+    async def main():
+        async with RawSender(base_url, _PROFILE, connections=1) as sender:
+            return await sender.post_async(
+                f"{base_url}/book", {}, {"S": "1"}, {"op": "שמירה"}
+            )
+
+    response = asyncio.run(main())
+    assert response.status == 200
+    assert response.text == (
+        '<div class="alert alert-dismissible"><div>הזמנה של my-user נוצר.</div></div>'
+    )
+    assert response.cookies == {"S": "1", "flash": "created"}
+
+
+def test_closed_connections_are_replaced(stand_in_site):
+    async def book(request: web.Request) -> web.Response:
+        await request.post()
+        response = web.Response(text=BOOKED_PAGE, content_type="text/html")
+        response.force_close()
+        return response
+
+    routes = web.RouteTableDef()
+    routes.post("/book")(book)
+    base_url = stand_in_site(routes).url
+
+    async def main():
+        # all but the first request pipelined on a connection are lost with it,
+        # more than once for most of them
+        async with RawSender(base_url, _PROFILE, connections=1) as sender:
+            return await asyncio.gather(
+                *(sender.post_async(f"{base_url}/book", {}, {}, {}) for _ in range(10))
+            )
+
+    responses = asyncio.run(main())
+    assert len(responses) == 10
+    assert all("נוצר" in response.text for response in responses)
+
+
+def test_book_room_with_raw_sender(stand_in_site):
+    async def book(request: web.Request) -> web.Response:
+        assert (await request.post())["form_token"] == "token"
+        return web.Response(text=BOOKED_PAGE, content_type="text/html")
+
+    routes = web.RouteTableDef()
+    routes.post("/{tail:.*}")(book)
+    base_url = stand_in_site(routes).url
+
+    async def main():
+        creds = SessionCredentials(
+            cookie=SessionCookie({"SESS1": "id"}),
+            form_token=FormToken("token"),
+            account="my-account",
+        )
+        async with RawSender(base_url, _PROFILE) as sender:
+            # the profile's url keeps its host, the sender decides where it goes
+            return await book_room(
+                creds,
+                datetime(2024, 5, 26, 8, 0),
+                "14343",
+                logger,
+                _PROFILE,
+                sender=sender,
+            )
+
+    assert asyncio.run(main())
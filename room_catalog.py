@@ -0,0 +1,173 @@
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+from models import Room
+from site_profile import SiteProfile, active_profile
+
+_CATALOG_PATH_ENV = "ROOM_CATALOG_PATH"
+_DEFAULT_CATALOG_PATH = Path("room_catalog.json")
+_CATALOG_SCHEMA = 1  # bump when the file layout changes, older files are ignored
+_CATALOG_MAX_AGE = timedelta(hours=12)
+_REFRESH_RETRY_INTERVAL = timedelta(minutes=10)  # between background refresh attempts
+
+
+@dataclasses.dataclass(frozen=True)
+class RoomCatalog:
+    profile: str
+    rooms: dict[str, str]  # room name to room id, in page order
+    version: str
+    fetched_at: Optional[datetime]  # None when built from the profile, not the site
+
+    def has_room(self, room_id: str) -> bool:
+        return room_id in self.rooms.values()
+
+    def is_stale(self, now: Optional[datetime] = None) -> bool:
+        if self.fetched_at is None:
+            return True
+        return (now or datetime.now()) - self.fetched_at > _CATALOG_MAX_AGE
+
+
+def _version(rooms: dict[str, str]) -> str:
+    """
+    content hash, so the version only changes when the room list does
+    """
+    encoded = json.dumps(rooms, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    return hashlib.sha1(encoded).hexdigest()[:12]
+
+
+def _make_catalog(
+    profile: str, rooms: dict[str, str], fetched_at: Optional[datetime]
+) -> RoomCatalog:
+    return RoomCatalog(
+        profile=profile, rooms=rooms, version=_version(rooms), fetched_at=fetched_at
+    )
+
+
+def _catalog_path() -> Path:
+    return Path(os.environ.get(_CATALOG_PATH_ENV, _DEFAULT_CATALOG_PATH))
+
+
+def _load(path: Path, profile: SiteProfile) -> Optional[RoomCatalog]:
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if data.get("schema") != _CATALOG_SCHEMA or data.get("profile") != profile.name:
+        return None
+    return _make_catalog(
+        profile.name, data["rooms"], datetime.fromisoformat(data["fetched_at"])
+    )
+
+
+def _save(path: Path, catalog: RoomCatalog):
+    data = {
+        "schema": _CATALOG_SCHEMA,
+        "profile": catalog.profile,
+        "version": catalog.version,
+        "fetched_at": catalog.fetched_at.isoformat(),
+        "rooms": catalog.rooms,
+    }
+    temp_path = path.with_suffix(".tmp")
+    temp_path.write_text(
+        json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8"
+    )
+    os.replace(temp_path, path)  # readers never see a half written file
+
+
+_lock = threading.Lock()
+_catalog: Optional[RoomCatalog] = None
+_refreshing = False
+_last_refresh_attempt: Optional[datetime] = None
+
+
+def catalog(profile: Optional[SiteProfile] = None) -> RoomCatalog:
+    """
+    never touches the network: the disk cache is read once, then the catalog is served from memory.
+    with no cache, the room list of the site profile is used until the first fetch
+    """
+    global _catalog
+    profile = profile or active_profile()
+    current = _catalog
+    if current is not None and current.profile == profile.name:
+        return current
+    with _lock:
+        if _catalog is None or _catalog.profile != profile.name:
+            _catalog = _load(_catalog_path(), profile) or _make_catalog(
+                profile.name, dict(profile.rooms), fetched_at=None
+            )
+        return _catalog
+
+
+def update_from_rooms(
+    rooms: Iterable[Room], logger: logging.Logger, profile: Optional[SiteProfile] = None
+):
+    """
+    called with every parsed reservations page. the catalog is swapped in place,
+    the disk copy is only rewritten when the room list changed or went stale
+    """
+    global _catalog
+    profile = profile or active_profile()
+    found = {room.name: room.id for room in rooms}
+    if not found:  # a failed page, keep what we have
+        return
+    current = catalog(profile)
+    updated = _make_catalog(profile.name, found, fetched_at=datetime.now())
+    with _lock:
+        _catalog = updated
+    if updated.version == current.version and not current.is_stale():
+        return
+    logger.info(f"RoomCatalogUpdated: {updated.version} {updated.rooms}")
+    try:
+        _save(_catalog_path(), updated)
+    except OSError as e:
+        logger.error(f"RoomCatalogSaveFailed: {e}")
+
+
+def _refresh(
+    fetch: Callable[[], Iterable[Room]], logger: logging.Logger, profile: SiteProfile
+):
+    global _refreshing
+    try:
+        update_from_rooms(fetch(), logger, profile)
+    except Exception as e:
+        logger.error(f"RoomCatalogRefreshFailed: {e}")
+    finally:
+        _refreshing = False
+
+
+def refresh_in_background(
+    fetch: Callable[[], Iterable[Room]],
+    logger: logging.Logger,
+    profile: Optional[SiteProfile] = None,
+):
+    """
+    at most one refresh runs at a time and attempts are spaced out,
+    callers keep being served the current catalog
+    """
+    global _refreshing, _last_refresh_attempt
+    profile = profile or active_profile()
+    now = datetime.now()
+    with _lock:
+        if _refreshing:
+            return
+        if (
+            _last_refresh_attempt is not None
+            and now - _last_refresh_attempt < _REFRESH_RETRY_INTERVAL
+        ):
+            return
+        _refreshing = True
+        _last_refresh_attempt = now
+    thread = threading.Thread(
+        target=_refresh,
+        args=(fetch, logger, profile),
+        name="RoomCatalogRefresh",
+        daemon=True,
+    )
+    thread.start()
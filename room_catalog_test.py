@@ -0,0 +1,89 @@
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+import room_catalog
+from models import Room
+from site_profile import active_profile
+
+logger = logging.getLogger()
+
+
+@pytest.fixture(autouse=True)
+def catalog_file(tmp_path, monkeypatch):
+    path = tmp_path / "room_catalog.json"
+    monkeypatch.setenv("ROOM_CATALOG_PATH", str(path))
+    monkeypatch.setattr(room_catalog, "_catalog", None)
+    monkeypatch.setattr(room_catalog, "_refreshing", False)
+    monkeypatch.setattr(room_catalog, "_last_refresh_attempt", None)
+    return path
+
+
+def _rooms() -> list[Room]:
+    return [
+        Room(name="האולם הלבן", id="14343", available_slots=[]),
+        Room(name="חדר חדש", id="99999", available_slots=[]),
+    ]
+
+
+def test_falls_back_to_profile_rooms():
+    catalog = room_catalog.catalog()
+    assert catalog.rooms == active_profile().rooms
+    assert catalog.fetched_at is None
+    assert catalog.is_stale()
+
+
+def test_update_from_rooms_is_persisted(catalog_file, monkeypatch):
+    initial_version = room_catalog.catalog().version
+    room_catalog.update_from_rooms(_rooms(), logger)
+    catalog = room_catalog.catalog()
+    assert catalog.rooms == {"האולם הלבן": "14343", "חדר חדש": "99999"}
+    assert catalog.version != initial_version
+    assert catalog.has_room("99999")
+    assert not catalog.is_stale()
+
+    # a fresh process serves the cached catalog without fetching
+    monkeypatch.setattr(room_catalog, "_catalog", None)
+    assert room_catalog.catalog() == catalog
+    assert catalog_file.exists()
+
+
+def test_empty_page_keeps_catalog():
+    room_catalog.update_from_rooms(_rooms(), logger)
+    catalog = room_catalog.catalog()
+    room_catalog.update_from_rooms([], logger)
+    assert room_catalog.catalog() == catalog
+
+
+def test_other_profile_cache_is_ignored(catalog_file):
+    catalog_file.write_text(
+        '{"schema": 1, "profile": "other", "version": "x", '
+        '"fetched_at": "2024-05-25T08:00:00", "rooms": {"a": "1"}}',
+        encoding="utf-8",
+    )
+    assert room_catalog.catalog().rooms == active_profile().rooms
+
+
+def test_stale_catalog():
+    room_catalog.update_from_rooms(_rooms(), logger)
+    catalog = room_catalog.catalog()
+    assert catalog.is_stale(now=datetime.now() + timedelta(days=1))
+
+
+def test_refresh_in_background_does_not_block():
+    release = threading.Event()
+
+    def fetch():
+        release.wait(timeout=5)
+        return _rooms()
+
+    room_catalog.refresh_in_background(fetch, logger)
+    assert room_catalog.catalog().fetched_at is None  # still serving the old catalog
+    room_catalog.refresh_in_background(fetch, logger)  # already refreshing, ignored
+    release.set()
+    for thread in threading.enumerate():
+        if thread.name == "RoomCatalogRefresh":
+            thread.join(timeout=5)
+    assert room_catalog.catalog().has_room("99999")
@@ -1,12 +1,50 @@
 import asyncio
 import logging
+import os
 import threading
 import time
+import urllib.parse
 from datetime import datetime, timedelta
+from pathlib import Path
 from typing import Optional
 
-from models import ScheduleRoomCommand, SessionCredentials
-from visual_theater import query_session_creds, book_room, query_rooms
+import aiohttp
+import requests
+
+import http_recording
+from dispatch import (
+    HedgedDispatcher,
+    NetworkPath,
+    measure_site_paths,
+    _MEASURE_DEADLINE,
+)
+from governor import Priority, governor
+from http_transport import LiveTransport, Transport, ssl_context
+from models import (
+    ScheduleRoomCommand,
+    SessionCredentials,
+    Credentials,
+    SessionCookie,
+    FormToken,
+)
+from parse_pool import parse_pool
+import room_catalog
+from raw_sender import RawSender
+from site_profile import SiteProfile, active_profile
+from timing_report import TimingReport
+from visual_theater import (
+    query_session_creds,
+    book_room,
+    query_rooms_async,
+    query_room_catalog,
+    get_transport,
+    _booking_payload,
+    _is_booking_successful,
+    _parse_booking_confirmation_message,
+    _parse_form_token,
+    _parse_rooms,
+    _reservation_url,
+)
 
 _STATUS_IDLE = "idle"  # MUST match js code
 _STATUS_WAITING_FOR_BOOKING_TO_START = "Waiting for booking to start"
@@ -19,7 +57,7 @@ _STATUS_ALTERNATIVE_BOOKING = "Alternative booking"
 status = _STATUS_IDLE  # this is a global mutable variable that will be used to store the status of the booking process
 
 
-def _sleep_until(awake_time: datetime):
+def _seconds_until(awake_time: datetime) -> float:
     now = datetime.now()
     target_time = now.replace(
         hour=awake_time.hour,
@@ -32,14 +70,26 @@ def _sleep_until(awake_time: datetime):
     if target_time < now:
         target_time += timedelta(days=1)
 
-    sleep_seconds = (target_time - now).total_seconds()
-    time.sleep(sleep_seconds)
+    return (target_time - now).total_seconds()
+
+
+def _sleep_until(awake_time: datetime):
+    time.sleep(_seconds_until(awake_time))
+
+
+def _seconds_left(until: datetime) -> float:
+    """
+    like _seconds_until, but negative when the time passed less than half a day ago
+    """
+    seconds = _seconds_until(until)
+    return seconds - 24 * 3600 if seconds > 12 * 3600 else seconds
 
 
 _SEND_BOOKING_TIME = datetime(
     year=1, month=1, day=1, hour=8, minute=0, second=0
 )  # only time matters
 _ALTERNATIVE_BOOKING_ENABLED = True
+_SETTINGS_VERSION = 0
 
 import platform
 
@@ -47,23 +97,196 @@ if platform.system() == "Windows":
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
 
-async def _concurrent_book_room(
+async def _burst(
     creds: SessionCredentials,
     time_: datetime,
     room_id: str,
     logger: logging.Logger,
+    profile: SiteProfile,
+    report: TimingReport,
+    sender: Optional[Transport],
 ) -> bool:
     tasks = []
     duration = 3
     time_between = 0.1
-    start_time = datetime.now()
-    while datetime.now() - timedelta(seconds=duration) < start_time:
-        task = asyncio.create_task(book_room(creds, time_, room_id, logger))
+    started = time.perf_counter()
+    # a fixed count, a clock waking a little early must not add an attempt
+    for _ in range(round(duration / time_between)):
+        task = asyncio.create_task(
+            book_room(creds, time_, room_id, logger, profile, Priority.BURST, sender)
+        )
+        task.add_done_callback(
+            lambda _: report.record(
+                "first_booking_response", time.perf_counter() - started
+            )
+        )
         tasks.append(task)
-        await asyncio.sleep(time_between)
+        # until the next slot, not for a fixed time, so the pace does not drift
+        await asyncio.sleep(started + len(tasks) * time_between - time.perf_counter())
     logger.info(f"BookRoomConcurrentTasksStarted: {len(tasks)}")
-    results = await asyncio.gather(*tasks)
-    return any(results)
+    # a lost attempt is a failed one, it must not end the burst for the others
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error(f"BookingAttemptFailed: {result!r}")
+    return any(result is True for result in results)
+
+
+def _is_live_run(transport: Transport) -> bool:
+    if isinstance(transport, http_recording.RecordingTransport):
+        transport = transport.inner
+    return isinstance(transport, LiveTransport)
+
+
+_MIN_MEASURE_SECONDS = 0.2  # less than this before the burst and paths are not measured
+
+
+def _measure_paths(
+    profile: SiteProfile,
+    logger: logging.Logger,
+    report: TimingReport,
+    transport: Transport,
+    until: datetime,
+) -> list[NetworkPath]:
+    """
+    only a live run has network paths to spread the burst over, and only when they
+    can be measured before until. without any, the burst goes through the run's transport
+    """
+    if not _is_live_run(transport):
+        return []
+    deadline = min(_MEASURE_DEADLINE, _seconds_left(until) - _MIN_MEASURE_SECONDS)
+    if deadline < _MIN_MEASURE_SECONDS:
+        logger.info(f"MeasurePathsSkipped: {deadline:.2f}s left")
+        return []
+    try:
+        with report.measure("measure_paths"):
+            return measure_site_paths(profile.login_url, logger, deadline)
+    except OSError as e:
+        logger.error(f"MeasurePathsFailed: {e}")
+        return []
+
+
+_RAW_SENDER = os.environ.get("RAW_BURST_SENDER") == "1"  # the burst bypasses aiohttp
+
+
+def _recorded(sender, transport: Transport) -> Transport:
+    """
+    a recorded run records the burst too, whatever sends it
+    """
+    if isinstance(transport, http_recording.RecordingTransport):
+        return http_recording.RecordingTransport(sender, transport.recorder)
+    return sender
+
+
+async def _open_raw_sender(
+    profile: SiteProfile,
+    paths: list[NetworkPath],
+    logger: logging.Logger,
+    report: TimingReport,
+) -> Optional[RawSender]:
+    """
+    opened during the head start so the handshakes stay out of the burst.
+    without it the burst goes through aiohttp
+    """
+    if not _RAW_SENDER or not paths:
+        return None
+    sender = RawSender(profile.login_url, profile, [path.address for path in paths])
+    try:
+        with report.measure("open_raw_sender"):
+            await sender.open()
+    except OSError as e:
+        logger.error(f"RawSenderOpenFailed: {e}")
+        return None
+    return sender
+
+
+async def _concurrent_book_room(
+    creds: SessionCredentials,
+    time_: datetime,
+    room_id: str,
+    logger: logging.Logger,
+    profile: SiteProfile,
+    report: TimingReport,
+    transport: Transport,
+    sender: Optional[Transport] = None,
+) -> bool:
+    if sender is not None:
+        return await _burst(
+            creds, time_, room_id, logger, profile, report, _recorded(sender, transport)
+        )
+    return await _burst(creds, time_, room_id, logger, profile, report, transport)
+
+
+_WARM_LEAD = timedelta(seconds=2)  # servers close idle connections after a few seconds
+
+
+async def _warm_dispatcher(
+    dispatcher: HedgedDispatcher,
+    creds: SessionCredentials,
+    meeting: ScheduleRoomCommand,
+    logger: logging.Logger,
+    profile: SiteProfile,
+    report: TimingReport,
+    until: datetime,
+):
+    """
+    the burst's connections are opened and its hedge budgets learnt on the page it books,
+    what is not done by until is left to the burst
+    """
+    url = _reservation_url(profile, meeting.time, meeting.room)
+    try:
+        with report.measure("warm_dispatcher"):
+            await asyncio.wait_for(
+                dispatcher.warm(url, profile.headers, creds.cookie),
+                max(0.0, _seconds_left(until)),
+            )
+    except (OSError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error(f"WarmDispatcherFailed: {e!r}")
+
+
+async def _book_from_head_start(
+    creds: SessionCredentials,
+    meeting: ScheduleRoomCommand,
+    logger: logging.Logger,
+    profile: SiteProfile,
+    report: TimingReport,
+    paths: list[NetworkPath],
+    transport: Transport,
+    burst_start: datetime,
+) -> bool:
+    """
+    waits for the burst on the loop that runs it, the sender's connections belong to it
+    """
+    global status
+    sender = await _open_raw_sender(profile, paths, logger, report)
+    dispatcher = None
+    if sender is None and paths:
+        sender = dispatcher = HedgedDispatcher(paths, account=creds.account)
+        await dispatcher.open()
+    try:
+        # a run late for its window books right away, not a day later
+        if dispatcher is not None:
+            await asyncio.sleep(max(0.0, _seconds_left(burst_start - _WARM_LEAD)))
+            await _warm_dispatcher(
+                dispatcher, creds, meeting, logger, profile, report, burst_start
+            )
+        await asyncio.sleep(max(0.0, _seconds_left(burst_start)))
+        status = _STATUS_BOOKING
+        return await _concurrent_book_room(
+            creds,
+            meeting.time,
+            meeting.room,
+            logger,
+            profile,
+            report,
+            transport,
+            sender,
+        )
+    finally:
+        if dispatcher is not None:
+            logger.info(f"DispatchMetrics: {dispatcher.metrics()}")
+        if sender is not None:
+            await sender.close()
 
 
 def _deduce_alternative_time(
@@ -95,13 +318,17 @@ def _deduce_alternative_time(
     return None
 
 
-def _query_room_available_slots(
+async def _query_room_available_slots(
     creds: SessionCredentials,
     time_: datetime,
     room_id: str,
     logger: logging.Logger,
+    profile: SiteProfile,
+    transport: Transport,
 ) -> list[datetime]:
-    for room in query_rooms(creds.cookie, time_, logger):
+    for room in await query_rooms_async(
+        creds.cookie, creds.account, time_, logger, profile, transport
+    ):
         if room.id == room_id:
             return room.available_slots
     logger.error(f"RoomNotFoundError: {room_id}")
@@ -111,48 +338,238 @@ def _query_room_available_slots(
 _MAX_ALTERNATIVE_RETRIES = 5
 
 
-def _best_effort_alternative_booking(
+async def _best_effort_alternative_booking(
     creds: SessionCredentials,
     time_: datetime,
     room_id: str,
     logger: logging.Logger,
+    profile: SiteProfile,
+    transport: Transport,
 ) -> bool:
     for counter in range(_MAX_ALTERNATIVE_RETRIES):
         new_time = _deduce_alternative_time(
-            _query_room_available_slots(creds, time_, room_id, logger), logger
+            await _query_room_available_slots(
+                creds, time_, room_id, logger, profile, transport
+            ),
+            logger,
         )
         if new_time is None:
             return False
-        if asyncio.run(book_room(creds, new_time, room_id, logger)):
+        if await book_room(
+            creds, new_time, room_id, logger, profile, Priority.BOOKING, transport
+        ):
             return True
     logger.info("AlternativeBookingExceededMaxRetries")
     return False
 
 
-def schedule_room_thread(meeting: ScheduleRoomCommand, logger: logging.Logger):
+_RECORDING_DIR = os.environ.get("HTTP_RECORDING_DIR")  # every run is recorded when set
+
+
+def _start_recording(
+    meeting: ScheduleRoomCommand, profile: SiteProfile, transport: Transport
+) -> tuple[Optional[http_recording.Recorder], Transport]:
+    """
+    only live runs are recorded. the recorder and the transport the run goes through,
+    which records only this run's requests
+    """
+    if _RECORDING_DIR is None or not isinstance(transport, LiveTransport):
+        return None, transport
+    recorder = http_recording.Recorder(
+        header={
+            "profile": profile.name,
+            "meeting_time": meeting.time.isoformat(),
+            "room": meeting.room,
+            "send_booking_time": _SEND_BOOKING_TIME.strftime("%H:%M:%S"),
+            "alternative_booking": _ALTERNATIVE_BOOKING_ENABLED,
+        },
+        secret_fields=[
+            profile.login_username_field,
+            profile.login_password_field,
+            profile.form_token_field,
+        ],
+    )
+    return recorder, http_recording.RecordingTransport(transport, recorder)
+
+
+def _stop_recording(
+    recorder: Optional[http_recording.Recorder], logger: logging.Logger
+):
+    if recorder is None:
+        return
+    path = Path(_RECORDING_DIR) / f"booking-{datetime.now():%Y%m%d-%H%M%S}.jsonl.gz"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    recorder.save(path)
+    logger.info(f"HttpRecordingSaved: {path}")
+
+
+# a page with everything the parsers look for, in the default profile's markup
+_ARM_PAGE = """<html><body>
+<div class="alert-dismissible">arm</div>
+<input type="hidden" name="form_token" value="arm" />
+<div id="halls"><div class="grid-column hours-column"><ul>
+<li class="room-info"><a href="/he/node/1">arm</a></li>
+<li class="reservable"><span class="booking-span">
+<a href="/he/node/add/room-reservations-reservation/1/1/0800/1">08:00</a></span></li>
+<li class="booked"></li>
+</ul></div></div>
+</body></html>"""
+
+
+async def _serve_arm_page(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    headers = await reader.readuntil(b"\r\n\r\n")
+    for line in headers.split(b"\r\n"):
+        if line.lower().startswith(b"content-length:"):
+            await reader.readexactly(int(line.split(b":")[1]))
+    body = _ARM_PAGE.encode("utf-8")
+    writer.write(
+        b"HTTP/1.1 200 OK\r\nContent-Type: text/html; charset=utf-8\r\n"
+        b"Connection: close\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body)
+    )
+    await writer.drain()
+    writer.close()
+
+
+async def _arm_http_clients(
+    creds: SessionCredentials, profile: SiteProfile, logger: logging.Logger
+):
+    """
+    every http client of the burst makes a real exchange with a local server standing
+    in for the site, the dispatcher through its pinned resolver. the tls handshake is
+    not armed here, the dispatcher warms it against the site right before the burst
+    """
+    server = await asyncio.start_server(_serve_arm_page, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    url = f"http://127.0.0.1:{port}/arm"
+    transport = LiveTransport()
+    payload = _booking_payload(creds, profile)
+    try:
+        response = await transport.post_async(
+            url, profile.headers, creds.cookie, payload
+        )
+        _parse_booking_confirmation_message(response.text, logger, profile)
+        await asyncio.to_thread(transport.get, url, profile.headers, creds.cookie)
+        path = NetworkPath(address="127.0.0.1", port=port, rtt=0.0)
+        async with HedgedDispatcher([path]) as dispatcher:
+            # a name that never resolves, the pinned resolver answers for it
+            await dispatcher.post_async(
+                f"http://arm.invalid:{port}/arm", profile.headers, creds.cookie, payload
+            )
+        async with RawSender(url, profile, connections=1) as sender:
+            await sender.post_async(url, profile.headers, creds.cookie, payload)
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+_ARM_AHEAD = timedelta(seconds=60)  # before the head start, arming takes a few seconds
+
+
+def arm(profile: SiteProfile, logger: logging.Logger, report: TimingReport):
+    """
+    exercises, right before the head start, every code path the burst runs
+    so nothing pays a first use cost inside the booking window
+    """
+    creds = SessionCredentials(
+        cookie=SessionCookie({"arm": "arm"}), form_token=FormToken("arm"), account="arm"
+    )
+    with report.measure("arm_ssl_context"):
+        ssl_context()  # built once, every client of the burst shares it
+    with report.measure("arm_parsers"):
+        list(_parse_rooms(_ARM_PAGE, logger, profile))
+        _parse_form_token(_ARM_PAGE, profile)
+        _is_booking_successful(
+            _parse_booking_confirmation_message(_ARM_PAGE, logger, profile), profile
+        )
+    with report.measure("arm_encoders"):
+        payload = _booking_payload(creds, profile)
+        urllib.parse.urlencode(payload)
+        requests.Request("POST", profile.login_url, data=payload).prepare()
+    with report.measure("arm_http_clients"):
+        asyncio.run(_arm_http_clients(creds, profile, logger))
+    with report.measure("arm_parse_pool"):
+        parse_pool.start()  # workers are up long before the booking window
+
+
+def _refresh_room_catalog(
+    creds: SessionCredentials,
+    profile: SiteProfile,
+    logger: logging.Logger,
+    transport: Transport,
+):
+    """
+    the room list needs a logged in session, a finished run lends its own to a stale catalog
+    """
+    if not _is_live_run(transport) or not room_catalog.catalog(profile).is_stale():
+        return
+    room_catalog.refresh_in_background(
+        lambda: query_room_catalog(
+            creds.cookie, creds.account, logger, profile, transport
+        ),
+        logger,
+        profile,
+    )
+
+
+def schedule_room_thread(
+    meeting: ScheduleRoomCommand,
+    logger: logging.Logger,
+    transport: Optional[Transport] = None,
+):
     global status
+    profile = active_profile()  # one profile for the whole run
+    transport = transport or get_transport()  # and one transport
+    report = TimingReport("booking")
     status = _STATUS_WAITING_FOR_BOOKING_TO_START
     logger.info(f"Waiting for booking to start at {_SEND_BOOKING_TIME}")
-    _sleep_until(
-        _SEND_BOOKING_TIME - timedelta(seconds=10)
-    )  # head start to win the race
+    # head start to win the race
+    head_start = _SEND_BOOKING_TIME - timedelta(seconds=10)
+    # a booking may be scheduled a day ahead, what arm warms up would be cold by then
+    if _seconds_until(head_start) > _ARM_AHEAD.total_seconds():
+        _sleep_until(head_start - _ARM_AHEAD)
+    try:
+        arm(profile, logger, report)
+    except Exception as e:  # an unarmed run is slower, not broken
+        logger.error(f"ArmFailed: {e}")
+    report.log(logger)
+    # arm may run past the head start, that is no reason to wait a day
+    time.sleep(max(0.0, _seconds_left(head_start)))
+    recorder, run_transport = _start_recording(meeting, profile, transport)
+    session_credentials = None
     try:
         status = _STATUS_LOGGING_IN
-        session_credentials = query_session_creds(meeting.credentials)
+        with report.measure("login"):
+            session_credentials = query_session_creds(
+                meeting.credentials, profile, run_transport
+            )
         status = _STATUS_LOGGED_IN
-        _sleep_until(_SEND_BOOKING_TIME - timedelta(seconds=1))
-        status = _STATUS_BOOKING
+        burst_start = _SEND_BOOKING_TIME - timedelta(seconds=1)
+        paths = _measure_paths(profile, logger, report, run_transport, burst_start)
         if asyncio.run(
-            _concurrent_book_room(
-                session_credentials, meeting.time, meeting.room, logger
+            _book_from_head_start(
+                session_credentials,
+                meeting,
+                logger,
+                profile,
+                report,
+                paths,
+                run_transport,
+                burst_start,
             )
         ):
             status = _STATUS_SUCCESS
             return
         if _ALTERNATIVE_BOOKING_ENABLED:
             status = _STATUS_ALTERNATIVE_BOOKING
-            if _best_effort_alternative_booking(
-                session_credentials, meeting.time, meeting.room, logger
+            if asyncio.run(
+                _best_effort_alternative_booking(
+                    session_credentials,
+                    meeting.time,
+                    meeting.room,
+                    logger,
+                    profile,
+                    run_transport,
+                )
             ):
                 status = _STATUS_SUCCESS
                 return
@@ -160,6 +577,13 @@ def schedule_room_thread(meeting: ScheduleRoomCommand, logger: logging.Logger):
     except Exception as e:
         logger.error(f"ScheduleRoomTaskFailed: {e}")
         status = _STATUS_FAILED
+    finally:
+        report.log(logger)
+        logger.info(f"GovernorMetrics: {governor.metrics()}")
+        _stop_recording(recorder, logger)
+        if session_credentials is not None:
+            # after the recording is saved, so it goes through the unrecorded transport
+            _refresh_room_catalog(session_credentials, profile, logger, transport)
 
 
 def start_booking_process(meeting: ScheduleRoomCommand, logger: logging.Logger):
@@ -172,13 +596,54 @@ def real_get_status():
 
 
 def set_settings(start_booking_at: datetime, alternative_booking: bool):
-    global _SEND_BOOKING_TIME, _ALTERNATIVE_BOOKING_ENABLED
+    global _SEND_BOOKING_TIME, _ALTERNATIVE_BOOKING_ENABLED, _SETTINGS_VERSION
     _SEND_BOOKING_TIME = start_booking_at
     _ALTERNATIVE_BOOKING_ENABLED = alternative_booking
+    _SETTINGS_VERSION += 1
+
+
+def get_settings_version() -> int:
+    """
+    changes whenever the settings do, pages showing them are cached by it
+    """
+    return _SETTINGS_VERSION
 
 
 def get_send_booking_time():
     return _SEND_BOOKING_TIME
 
+
+def replay_schedule_room(recording_path: Path, logger: logging.Logger) -> dict:
+    """
+    runs a recorded booking again, offline: the same meeting goes through the whole pipeline
+    and every request is answered by its recorded response after the recorded latency.
+    the booking time is moved to right after the head start so phases keep their spacing
+    """
+    recording = http_recording.load(recording_path)
+    header = recording.header
+    if header["profile"] != active_profile().name:
+        logger.error(f"ReplayProfileMismatch: {header['profile']}")
+    meeting = ScheduleRoomCommand(
+        time=datetime.fromisoformat(header["meeting_time"]),
+        room=header["room"],
+        credentials=Credentials(username="replay", password="replay"),
+    )
+    previous_settings = (_SEND_BOOKING_TIME, _ALTERNATIVE_BOOKING_ENABLED)
+    replay = http_recording.ReplayTransport(recording)
+    # whole seconds, _sleep_until ignores microseconds
+    send_booking_time = (datetime.now() + timedelta(seconds=12)).replace(microsecond=0)
+    set_settings(send_booking_time, header["alternative_booking"])
+    started = time.monotonic()
+    try:
+        schedule_room_thread(meeting, logger, replay)
+    finally:
+        set_settings(*previous_settings)
+    return {
+        "status": status,
+        "seconds": time.monotonic() - started,
+        "unused_exchanges": replay.remaining(),
+    }
+
+
 def get_alternative_bookings():
-    return _ALTERNATIVE_BOOKING_ENABLED
\ No newline at end of file
+    return _ALTERNATIVE_BOOKING_ENABLED
@@ -1,8 +1,34 @@
+import asyncio
 import logging
+import threading
+import time
 
 import pytest
-from datetime import datetime
-from schedule_room import _deduce_alternative_time
+from aiohttp import web
+from datetime import datetime, timedelta
+
+import schedule_room
+from conftest import BOOKED_PAGE, stand_in_profile
+from dispatch import NetworkPath
+from http_recording import Recorder
+from http_transport import HttpResponse, LiveTransport
+from models import (
+    Credentials,
+    FormToken,
+    ScheduleRoomCommand,
+    SessionCookie,
+    SessionCredentials,
+)
+from schedule_room import (
+    _arm_http_clients,
+    _book_from_head_start,
+    _burst,
+    _deduce_alternative_time,
+    _measure_paths,
+    replay_schedule_room,
+)
+from site_profile import active_profile
+from timing_report import TimingReport
 
 logger = logging.getLogger()
 
@@ -122,3 +148,205 @@ def test_3_hour_window_in_end_with_more_than_6_items():
     ]
     result = _deduce_alternative_time(available_windows, logger)
     assert result == datetime(2024, 5, 25, 10, 0)
+
+
+def test_http_clients_are_armed():
+    creds = SessionCredentials(
+        cookie=SessionCookie({"arm": "arm"}), form_token=FormToken("arm"), account="arm"
+    )
+    # raises when a client does not finish its exchange
+    asyncio.run(_arm_http_clients(creds, active_profile(), logger))
+
+
+def test_paths_are_not_measured_into_the_burst(caplog):
+    with caplog.at_level(logging.INFO):
+        paths = _measure_paths(
+            active_profile(),
+            logger,
+            TimingReport("test"),
+            LiveTransport(),
+            until=datetime.now(),
+        )
+    assert paths == []
+    assert "MeasurePathsSkipped" in caplog.text
+
+
+def _book_from_a_head_start(site, report: TimingReport, seconds: float) -> bool:
+    creds = SessionCredentials(
+        cookie=SessionCookie({"SESS1": "id"}),
+        form_token=FormToken("token"),
+        account="my-account",
+    )
+    meeting = ScheduleRoomCommand(
+        time=datetime(2024, 5, 26, 8, 0),
+        room="14343",
+        credentials=Credentials(username="my-user", password="my-pass"),
+    )
+    return asyncio.run(
+        _book_from_head_start(
+            creds,
+            meeting,
+            logger,
+            stand_in_profile(site.url),
+            report,
+            [NetworkPath(address="127.0.0.1", port=site.port, rtt=0.001)],
+            LiveTransport(),
+            datetime.now() + timedelta(seconds=seconds),
+        )
+    )
+
+
+def test_raw_sender_is_opened_during_the_head_start(stand_in_site, monkeypatch):
+    monkeypatch.setattr(schedule_room, "_RAW_SENDER", True)
+    connections = set()
+    routes = web.RouteTableDef()
+
+    @routes.post("/{tail:.*}")
+    async def book(request: web.Request) -> web.Response:
+        connections.add(request.transport)
+        await request.post()
+        return web.Response(text=BOOKED_PAGE, content_type="text/html")
+
+    report = TimingReport("test")
+    assert _book_from_a_head_start(stand_in_site(routes), report, seconds=1)
+    assert "open_raw_sender" in report.timings()
+    assert len(connections) <= 4  # the burst used the connections opened ahead
+
+
+def test_dispatcher_is_warmed_during_the_head_start(stand_in_site):
+    warmed, used = set(), set()
+    routes = web.RouteTableDef()
+
+    @routes.get("/{tail:.*}")
+    async def page(request: web.Request) -> web.Response:
+        warmed.add(request.transport)
+        return web.Response(text="<html></html>", content_type="text/html")
+
+    @routes.post("/{tail:.*}")
+    async def book(request: web.Request) -> web.Response:
+        used.add(request.transport)
+        await request.post()
+        return web.Response(text=BOOKED_PAGE, content_type="text/html")
+
+    report = TimingReport("test")
+    assert _book_from_a_head_start(stand_in_site(routes), report, seconds=3)
+    assert "warm_dispatcher" in report.timings()
+    assert used <= warmed  # the burst used the connections opened ahead
+
+
+def _recorded_run(path, booked_on: int):
+    """
+    a run as the recorder saves it: log in, the form token page and a burst of 30
+    """
+    profile = active_profile()
+    meeting_time = datetime(2024, 5, 26, 8, 0)
+    recorder = Recorder(
+        header={
+            "profile": profile.name,
+            "meeting_time": meeting_time.isoformat(),
+            "room": "14343",
+            "send_booking_time": "08:00:00",
+            "alternative_booking": False,
+        },
+        secret_fields=[profile.form_token_field],
+    )
+    sent = time.monotonic()
+    cookies = {"SESS1": "session-id"}
+    recorder.record(
+        "POST", profile.login_url, {}, {}, sent, HttpResponse(302, {}, "", cookies)
+    )
+    token_page = '<input type="hidden" name="form_token" value="recorded-token" />'
+    recorder.record(
+        "GET",
+        profile.reservation_url.format(
+            month=5, day=26, hourminute="0800", room_id=profile.token_probe_room_id
+        ),
+        {},
+        cookies,
+        sent,
+        HttpResponse(200, {}, token_page, cookies),
+    )
+    booking_url = profile.reservation_url.format(
+        month=5, day=26, hourminute="0800", room_id="14343"
+    )
+    for attempt in range(30):
+        page = BOOKED_PAGE if attempt == booked_on else "<p>taken</p>"
+        recorder.record(
+            "POST", booking_url, {}, cookies, sent, HttpResponse(200, {}, page, cookies)
+        )
+    recorder.save(path)
+
+
+def test_recorded_run_replays_through_the_booking_pipeline(tmp_path):
+    path = tmp_path / "booking.jsonl.gz"
+    _recorded_run(path, booked_on=4)
+
+    result = replay_schedule_room(path, logger)
+
+    assert result["status"] == schedule_room._STATUS_SUCCESS
+    assert result["unused_exchanges"] == 0
+
+
+class _SiteDown:
+    def post(self, url, headers, cookies, data):
+        raise OSError("site down")
+
+
+def test_arm_overrunning_the_head_start_does_not_delay_the_run(monkeypatch):
+    # the head start is at most a second away
+    send_booking_time = datetime.now() + timedelta(seconds=11)
+    monkeypatch.setattr(schedule_room, "_SEND_BOOKING_TIME", send_booking_time)
+    monkeypatch.setattr(schedule_room, "arm", lambda *_: time.sleep(1.5))
+    meeting = ScheduleRoomCommand(
+        time=datetime(2024, 5, 26, 8, 0),
+        room="14343",
+        credentials=Credentials(username="my-user", password="my-pass"),
+    )
+    run = threading.Thread(
+        target=schedule_room.schedule_room_thread,
+        args=(meeting, logger, _SiteDown()),
+        daemon=True,
+    )
+    run.start()
+    run.join(timeout=10)
+    assert not run.is_alive()
+    assert schedule_room.status == schedule_room._STATUS_FAILED
+
+
+class _LosesAttempts:
+    """
+    loses every attempt but the tenth, like connections failing through the burst
+    """
+
+    def __init__(self):
+        self.attempts = 0
+
+    async def post_async(self, url, headers, cookies, data):
+        self.attempts += 1
+        if self.attempts != 10:
+            raise ConnectionResetError("connection closed")
+        return HttpResponse(200, {}, BOOKED_PAGE, dict(cookies))
+
+
+def test_lost_attempts_do_not_end_the_burst(caplog):
+    creds = SessionCredentials(
+        cookie=SessionCookie({"SESS1": "id"}),
+        form_token=FormToken("token"),
+        account="my-account",
+    )
+    sender = _LosesAttempts()
+    with caplog.at_level(logging.ERROR):
+        booked = asyncio.run(
+            _burst(
+                creds,
+                datetime(2024, 5, 26, 8, 0),
+                "14343",
+                logger,
+                active_profile(),
+                TimingReport("test"),
+                sender,
+            )
+        )
+    assert booked
+    assert sender.attempts == 30
+    assert caplog.text.count("BookingAttemptFailed") == 29
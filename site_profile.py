@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import dataclasses
+import os
+from pathlib import Path
+from typing import Optional, TYPE_CHECKING
+
+from pydantic import BaseModel
+
+if TYPE_CHECKING:
+    import soupsieve  # imports bs4, only needed once a profile is compiled
+
+_DEFAULT_PROFILE_PATH = Path(__file__).parent / "site_profiles" / "visual_theatre.json"
+_PROFILE_PATH_ENV = "SITE_PROFILE"  # path to a profile json, overrides the default
+
+
+class UrlTemplates(BaseModel):
+    """
+    url templates are python format strings.
+    "{base_url}" is substituted once when the profile is compiled, the rest on every request:
+    reservations: month, day
+    reservation: month, day, hourminute, room_id
+    """
+
+    login: str
+    reservations: str
+    reservation: str
+
+
+class LoginForm(BaseModel):
+    username_field: str
+    password_field: str
+    fields: dict[str, str]
+
+
+class BookingForm(BaseModel):
+    form_token_field: str
+    # drupal date field, "[year]", "[month]" and "[day]" are appended
+    repeat_until_field: str
+    fields: dict[str, str]
+
+
+class Selectors(BaseModel):
+    halls: str
+    room: str
+    room_info: str
+    room_link: str
+    slot: str
+    slot_link: str
+    form_token: str
+    messages: list[str]  # checked in order, the first match is the response message
+
+
+class SlotClasses(BaseModel):
+    metadata: list[str]
+    unavailable: list[str]
+    available: list[str]
+
+
+class SiteProfileConfig(BaseModel):
+    """
+    declarative description of a drupal room_reservations site, as stored in site_profiles/*.json
+    """
+
+    name: str
+    base_url: str
+    user_agent: str  # must be included but can be empty
+    urls: UrlTemplates
+    login_form: LoginForm
+    booking_form: BookingForm
+    selectors: Selectors
+    slot_classes: SlotClasses
+    success_markers: list[str]
+    token_probe_room_id: str  # arbitrary existing room, used to fetch a form token
+    rooms: dict[str, str]  # room name to room id
+
+
+@dataclasses.dataclass(frozen=True)
+class SiteProfile:
+    """
+    a site profile compiled for the hot path: url templates already hold the base url,
+    css selectors are precompiled matchers and class lists are frozensets
+    """
+
+    name: str
+    host: str
+    headers: dict[str, str]
+    login_url: str
+    reservations_url: str
+    reservation_url: str
+    login_username_field: str
+    login_password_field: str
+    login_fields: dict[str, str]
+    form_token_field: str
+    repeat_until_fields: tuple[str, str, str]  # year, month, day
+    booking_fields: dict[str, str]
+    halls: soupsieve.SoupSieve
+    room: soupsieve.SoupSieve
+    room_info: soupsieve.SoupSieve
+    room_link: soupsieve.SoupSieve
+    slot: soupsieve.SoupSieve
+    slot_link: soupsieve.SoupSieve
+    form_token: soupsieve.SoupSieve
+    messages: tuple[soupsieve.SoupSieve, ...]
+    metadata_classes: frozenset[str]
+    unavailable_classes: frozenset[str]
+    available_classes: frozenset[str]
+    success_markers: tuple[str, ...]
+    token_probe_room_id: str
+    rooms: dict[str, str]
+    config: SiteProfileConfig  # what it was compiled from, sent to parse pool workers
+
+
+def _compile_url(template: str, base_url: str, **sample) -> str:
+    """
+    formatting with sample values fails fast on a broken template instead of at booking time
+    """
+    url = template.replace("{base_url}", base_url.rstrip("/"))
+    url.format(**sample)
+    return url
+
+
+def _host(base_url: str) -> str:
+    return base_url.split("://", 1)[-1].split("/", 1)[0]
+
+
+def compile_profile(config: SiteProfileConfig) -> SiteProfile:
+    import soupsieve
+
+    selectors = config.selectors
+    repeat_until = config.booking_form.repeat_until_field
+    return SiteProfile(
+        name=config.name,
+        host=_host(config.base_url),
+        headers={"user-agent": config.user_agent},
+        login_url=_compile_url(config.urls.login, config.base_url),
+        reservations_url=_compile_url(
+            config.urls.reservations, config.base_url, month=1, day=1
+        ),
+        reservation_url=_compile_url(
+            config.urls.reservation,
+            config.base_url,
+            month=1,
+            day=1,
+            hourminute="0000",
+            room_id="0",
+        ),
+        login_username_field=config.login_form.username_field,
+        login_password_field=config.login_form.password_field,
+        login_fields=dict(config.login_form.fields),
+        form_token_field=config.booking_form.form_token_field,
+        repeat_until_fields=(
+            f"{repeat_until}[year]",
+            f"{repeat_until}[month]",
+            f"{repeat_until}[day]",
+        ),
+        booking_fields=dict(config.booking_form.fields),
+        halls=soupsieve.compile(selectors.halls),
+        room=soupsieve.compile(selectors.room),
+        room_info=soupsieve.compile(selectors.room_info),
+        room_link=soupsieve.compile(selectors.room_link),
+        slot=soupsieve.compile(selectors.slot),
+        slot_link=soupsieve.compile(selectors.slot_link),
+        form_token=soupsieve.compile(selectors.form_token),
+        messages=tuple(soupsieve.compile(message) for message in selectors.messages),
+        metadata_classes=frozenset(config.slot_classes.metadata),
+        unavailable_classes=frozenset(config.slot_classes.unavailable),
+        available_classes=frozenset(config.slot_classes.available),
+        success_markers=tuple(config.success_markers),
+        token_probe_room_id=config.token_probe_room_id,
+        rooms=dict(config.rooms),
+        config=config,
+    )
+
+
+def load_profile(path: Path) -> SiteProfile:
+    config = SiteProfileConfig.model_validate_json(
+        Path(path).read_text(encoding="utf-8")
+    )
+    return compile_profile(config)
+
+
+_active_profile: Optional[SiteProfile] = None
+
+
+def active_profile() -> SiteProfile:
+    """
+    the app compiles the profile at startup, scripts and tests on first use.
+    it is then shared by every request
+    """
+    global _active_profile
+    if _active_profile is None:
+        _active_profile = load_profile(
+            Path(os.environ.get(_PROFILE_PATH_ENV, _DEFAULT_PROFILE_PATH))
+        )
+    return _active_profile
@@ -0,0 +1,72 @@
+import json
+from datetime import datetime
+
+import pytest
+from pydantic import ValidationError
+
+from models import SessionCredentials, SessionCookie, FormToken
+from site_profile import (
+    SiteProfileConfig,
+    compile_profile,
+    load_profile,
+    _DEFAULT_PROFILE_PATH,
+)
+from visual_theater import _reservation_url, _booking_payload
+
+
+def _raw_default_profile() -> dict:
+    return json.loads(_DEFAULT_PROFILE_PATH.read_text(encoding="utf-8"))
+
+
+def test_default_profile_urls():
+    profile = load_profile(_DEFAULT_PROFILE_PATH)
+    assert profile.host == "students.visualtheatre.co.il"
+    assert profile.login_url == "https://students.visualtheatre.co.il/he"
+    assert (
+        profile.reservations_url.format(month=5, day=6)
+        == "https://students.visualtheatre.co.il/he/room_reservations/05/06"
+    )
+    assert (
+        _reservation_url(profile, datetime(2024, 5, 6, 8, 30), "14343")
+        == "https://students.visualtheatre.co.il/he/node/add/room-reservations-reservation/5/6/0830/14343"
+    )
+
+
+def test_booking_payload():
+    profile = load_profile(_DEFAULT_PROFILE_PATH)
+    creds = SessionCredentials(
+        cookie=SessionCookie({}), form_token=FormToken("token"), account="my-account"
+    )
+    payload = _booking_payload(creds, profile)
+    today = datetime.now()
+    assert payload == {
+        "form_token": "token",
+        "form_id": "room_reservations_reservation_node_form",
+        "reservation_length[und]": "180",
+        "reservation_repeat_until[und][0][value][year]": today.year,
+        "reservation_repeat_until[und][0][value][month]": today.month,
+        "reservation_repeat_until[und][0][value][day]": today.day,
+        "op": "שמירה",
+    }
+
+
+def test_other_site_base_url():
+    raw = _raw_default_profile()
+    raw["base_url"] = "http://127.0.0.1:8080/en/"
+    profile = compile_profile(SiteProfileConfig.model_validate(raw))
+    assert profile.host == "127.0.0.1:8080"
+    assert profile.login_url == "http://127.0.0.1:8080/en"
+
+
+def test_broken_url_template_fails_at_compile_time():
+    raw = _raw_default_profile()
+    raw["urls"]["reservation"] = "{base_url}/{month}/{day}/{unknown}"
+    with pytest.raises(KeyError):
+        compile_profile(SiteProfileConfig.model_validate(raw))
+
+
+def test_missing_field_fails_validation():
+    raw = _raw_default_profile()
+    del raw["selectors"]
+    with pytest.raises(ValidationError):
+        SiteProfileConfig.model_validate(raw)
@@ -0,0 +1,38 @@
+import contextlib
+import logging
+import threading
+import time
+
+
+class TimingReport:
+    """
+    durations of named steps. only the first measurement of a step is kept,
+    that is the cold one a regression shows up in
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._timings: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def record(self, step: str, seconds: float):
+        with self._lock:
+            self._timings.setdefault(step, seconds)
+
+    @contextlib.contextmanager
+    def measure(self, step: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(step, time.perf_counter() - started)
+
+    def timings(self) -> dict[str, float]:
+        with self._lock:
+            return dict(self._timings)
+
+    def log(self, logger: logging.Logger):
+        steps = ", ".join(
+            f"{step}={seconds * 1000:.1f}ms" for step, seconds in self.timings().items()
+        )
+        logger.info(f"TimingReport[{self.name}]: {steps}")
@@ -1,41 +1,77 @@
+import asyncio
 import logging
 
 from datetime import datetime
+from time import monotonic
 from typing import Optional
 
-import aiohttp
-
+from governor import Priority, account_key, governor
+from http_transport import HttpResponse, LiveTransport, Transport
 from models import Credentials, SessionCookie, Room, FormToken, SessionCredentials
+from parse_pool import parse_pool
+from site_profile import SiteProfile, active_profile
+import room_catalog
 
-import requests
 from bs4 import BeautifulSoup, Tag
 
+_transport: Transport = LiveTransport()  # runs that record or replay pass their own
 
-def log_in(creds: Credentials) -> SessionCookie:
-    session = requests.Session()
-    url = "https://students.visualtheatre.co.il/he"
-    headers = {
-        "user-agent": "",  # must be included but can be empty
-    }
+
+def get_transport() -> Transport:
+    return _transport
+
+
+def _report(profile: SiteProfile, response: HttpResponse, started: float):
+    governor.report(
+        profile.host,
+        response.status,
+        monotonic() - started,
+        response.headers.get("retry-after"),
+    )
+
+
+def _governed_get(
+    url: str,
+    cookie: SessionCookie,
+    account: str,
+    profile: SiteProfile,
+    priority: Priority,
+    transport: Transport,
+) -> HttpResponse:
+    governor.acquire(profile.host, account, priority)
+    started = monotonic()
+    response = transport.get(url, profile.headers, cookie)
+    _report(profile, response, started)
+    return response
+
+
+def log_in(
+    creds: Credentials,
+    profile: Optional[SiteProfile] = None,
+    transport: Optional[Transport] = None,
+) -> SessionCookie:
+    profile = profile or active_profile()
+    transport = transport or _transport
     data = {
-        "name": creds.username,
-        "pass": creds.password,
-        "form_id": "user_login",
-        "op": "%D7%9B%D7%A0%D7%99%D7%A1%D7%94",  # "כניסה" in hebrew
+        profile.login_username_field: creds.username,
+        profile.login_password_field: creds.password,
+        **profile.login_fields,
     }
 
-    response = session.post(url, headers=headers, data=data)
-    return SessionCookie(session.cookies.get_dict())
+    governor.acquire(profile.host, account_key(creds.username), Priority.BOOKING)
+    started = monotonic()
+    response = transport.post(profile.login_url, profile.headers, {}, data)
+    _report(profile, response, started)
+    return SessionCookie(response.cookies)
 
 
-def _is_available_slot(li: Tag, logger: logging.Logger) -> bool:
-    if "room-info" in li.get("class", []) or "timeslot" in li.get(
-        "class", []
-    ):  # metadata, not a time slot
+def _is_available_slot(li: Tag, logger: logging.Logger, profile: SiteProfile) -> bool:
+    classes = li.get("class", [])
+    if not profile.metadata_classes.isdisjoint(classes):  # metadata, not a time slot
         return False
-    elif "closed" in li.get("class", []) or "booked" in li.get("class", []):
+    elif not profile.unavailable_classes.isdisjoint(classes):
         return False
-    elif "reservable" in li.get("class", []):
+    elif not profile.available_classes.isdisjoint(classes):
         return True
     else:
         logger.error(f"Unknown slot status: {li}")
@@ -43,15 +79,15 @@ def _is_available_slot(li: Tag, logger: logging.Logger) -> bool:
 
 
 def _parse_available_slots(
-    room: BeautifulSoup, logger: logging.Logger
+    room: BeautifulSoup, logger: logging.Logger, profile: SiteProfile
 ) -> list[datetime]:
     """
     we do not get the time of unavailable slots, so we only parse the available ones
     """
-    for li in room.select("li"):
-        if _is_available_slot(li, logger):
+    for li in profile.slot.select(room):
+        if _is_available_slot(li, logger, profile):
             # slot link is "/he/node/add/room-reservations-reservation/{month}/{day}/{hourminute}/{room_id}"
-            slot_link = li.select_one(".booking-span a")["href"]
+            slot_link = profile.slot_link.select_one(li)["href"]
             time = slot_link.split("/")[-2]
             hour = time[:2]
             minute = time[2:]
@@ -66,80 +102,98 @@ def _parse_available_slots(
             )
 
 
-def _room_id(metadata: Tag) -> str:
+def _room_id(metadata: Tag, profile: SiteProfile) -> str:
     """
     url of room metadata is "/he/node/{room_id}"
     """
-    return metadata.select_one("a")["href"].split("/")[-1]
+    return profile.room_link.select_one(metadata)["href"].split("/")[-1]
 
 
-def _parse_room(room: BeautifulSoup, logger: logging.Logger) -> Optional[Room]:
+def _parse_room(
+    room: BeautifulSoup, logger: logging.Logger, profile: SiteProfile
+) -> Optional[Room]:
     """
     room metadata is a li with class "room-info"
     room slots are lis nested in the room div
     metadata text value is the room name
     """
-    metadata = room.find("li", class_="room-info")
+    metadata = profile.room_info.select_one(room)
     if metadata is None:
         logger.error(f"Room metadata not found in {room}")
         return None
 
     return Room(
         name=metadata.text.strip(),
-        id=_room_id(metadata),
-        available_slots=list(_parse_available_slots(room, logger)),
+        id=_room_id(metadata, profile),
+        available_slots=list(_parse_available_slots(room, logger, profile)),
     )
 
 
-def _rooms(response: BeautifulSoup) -> list[BeautifulSoup]:
+def _rooms(response: BeautifulSoup, profile: SiteProfile) -> list[BeautifulSoup]:
     """
     rooms are divs with class "grid-column hours-column" nested in div with id "halls"
-    excluding rooms without a link to their metadata
+    excluding rooms without a link to their metadata.
+    a page without halls, like the login page served to a logged out session, has no rooms
     """
-    rooms = response.find("div", id="halls").find_all(
-        "div", class_="grid-column hours-column"
-    )
+    halls = profile.halls.select_one(response)
+    if halls is None:
+        return []
+    rooms = profile.room.select(halls)
     result = []
     for room in rooms:
-        if (
-            room.find("li", class_="room-info").select_one("a") is None
-        ):  # not an actual room
+        metadata = profile.room_info.select_one(room)
+        if profile.room_link.select_one(metadata) is None:  # not an actual room
             continue
         result.append(room)
     return result
 
 
-def _parse_rooms(html: str, logger: logging.Logger) -> list[Room]:
+def _parse_rooms(
+    html: str, logger: logging.Logger, profile: Optional[SiteProfile] = None
+) -> list[Room]:
+    profile = profile or active_profile()
     soup = BeautifulSoup(html, "html.parser")
-    for room in _rooms(soup):
-        if parsed_room := _parse_room(room, logger):
+    for room in _rooms(soup, profile):
+        if parsed_room := _parse_room(room, logger, profile):
             yield parsed_room
 
 
-def _query_rooms(cookie: SessionCookie, date: datetime) -> str:
-    # url date and month must be two-digit numbers (e.g. 01 not 1)
-    url = f"https://students.visualtheatre.co.il/he/room_reservations/{date.strftime('%m')}/{date.strftime('%d')}"
-    headers = {
-        "user-agent": "",  # must be included but can be empty
-    }
-    response = requests.get(url, headers=headers, cookies=cookie)
-    return response.text
+def _query_rooms(
+    cookie: SessionCookie,
+    account: str,
+    date: datetime,
+    profile: SiteProfile,
+    priority: Priority,
+    transport: Transport,
+) -> str:
+    # url date and month must be two-digit numbers (e.g. 01 not 1), the profile template pads them
+    url = profile.reservations_url.format(month=date.month, day=date.day)
+    return _governed_get(url, cookie, account, profile, priority, transport).text
+
 
+def _reservation_url(profile: SiteProfile, time: datetime, room_id: str) -> str:
+    """
+    url is "/he/node/add/room-reservations-reservation/{month}/{day}/{hourminute}/{room_id}"
+    """
+    return profile.reservation_url.format(
+        month=time.month,
+        day=time.day,
+        hourminute=time.strftime("%H%M"),
+        room_id=room_id,
+    )
 
-def _query_form_token(cookie: SessionCookie) -> str:
+
+def _query_form_token(
+    cookie: SessionCookie, account: str, profile: SiteProfile, transport: Transport
+) -> str:
     """
     we must query a room reservations page to get the form token
     it does not have to be a valid page because we only need the token
-    https://students.visualtheatre.co.il/he/node/add/room-reservations-reservation/{month}/{day}/{hourminute}/{room_id}
     """
-    time_right_now = datetime.now()
-    room_number = 14343  # arbitrary existing room number
-    url = f"https://students.visualtheatre.co.il/he/node/add/room-reservations-reservation/{time_right_now.month}/{time_right_now.day}/{time_right_now.strftime('%H%M')}/{room_number}"
-    headers = {
-        "user-agent": "",  # must be included but can be empty
-    }
-    response = requests.get(url, headers=headers, cookies=cookie)
-    return response.text
+    url = _reservation_url(profile, datetime.now(), profile.token_probe_room_id)
+    return _governed_get(
+        url, cookie, account, profile, Priority.BOOKING, transport
+    ).text
 
 
 def _parse_page_date(html: str) -> datetime:
@@ -171,92 +225,176 @@ def _is_valid_data(rooms: list[Room], queried_date: datetime) -> bool:
     )
 
 
-def _parse_form_token(html: str) -> str:
+def _parse_form_token(html: str, profile: Optional[SiteProfile] = None) -> str:
+    profile = profile or active_profile()
     soup = BeautifulSoup(html, "html.parser")
-    token = soup.find("input", {"name": "form_token"})
+    token = profile.form_token.select_one(soup)
     return token["value"]
 
 
 def query_rooms(
-    cookie: SessionCookie, date: datetime, logger: logging.Logger
+    cookie: SessionCookie,
+    account: str,
+    date: datetime,
+    logger: logging.Logger,
+    profile: Optional[SiteProfile] = None,
+    transport: Optional[Transport] = None,
 ) -> list[Room]:
-    response = _query_rooms(cookie, date)
-    result = list(_parse_rooms(response, logger))
+    profile = profile or active_profile()
+    response = _query_rooms(
+        cookie, account, date, profile, Priority.POLLING, transport or _transport
+    )
+    result = list(_parse_rooms(response, logger, profile))
+    # the room list is valid even when the site fell back to the rooms of today
+    room_catalog.update_from_rooms(result, logger, profile)
     if not _is_valid_data(result, date):
         raise ValueError(f"Invalid data for date {date}")
     return result
 
 
-def query_form_token(cookie: SessionCookie) -> FormToken:
-    return FormToken(_parse_form_token(_query_form_token(cookie)))
+async def query_rooms_async(
+    cookie: SessionCookie,
+    account: str,
+    date: datetime,
+    logger: logging.Logger,
+    profile: Optional[SiteProfile] = None,
+    transport: Optional[Transport] = None,
+) -> list[Room]:
+    """
+    query_rooms for async code: the request runs in a thread, the page is parsed
+    in the parse pool and the catalog is saved in a thread
+    """
+    profile = profile or active_profile()
+    response = await asyncio.to_thread(
+        _query_rooms,
+        cookie,
+        account,
+        date,
+        profile,
+        Priority.POLLING,
+        transport or _transport,
+    )
+    result = await parse_pool.parse_rooms(response, logger, profile)
+    await asyncio.to_thread(room_catalog.update_from_rooms, result, logger, profile)
+    if not _is_valid_data(result, date):
+        raise ValueError(f"Invalid data for date {date}")
+    return result
 
 
-async def _request_book_meeting(
-    creds: SessionCredentials, time: datetime, room_id: str
-) -> str:
+def query_room_catalog(
+    cookie: SessionCookie,
+    account: str,
+    logger: logging.Logger,
+    profile: Optional[SiteProfile] = None,
+    transport: Optional[Transport] = None,
+) -> list[Room]:
     """
-    url is "/he/node/add/room-reservations-reservation/{month}/{day}/{hourminute}/{room_id}"
-
+    rooms of today, only their names and ids are of interest so the date is not validated
     """
-    url = f"https://students.visualtheatre.co.il/he/node/add/room-reservations-reservation/{time.month}/{time.day}/{time.strftime('%H%M')}/{room_id}"
-    headers = {
-        "user-agent": "",  # must be included but can be empty
-    }
+    profile = profile or active_profile()
+    response = _query_rooms(
+        cookie,
+        account,
+        datetime.now(),
+        profile,
+        Priority.BACKGROUND,
+        transport or _transport,
+    )
+    return list(_parse_rooms(response, logger, profile))
+
+
+def query_form_token(
+    cookie: SessionCookie,
+    account: str,
+    profile: Optional[SiteProfile] = None,
+    transport: Optional[Transport] = None,
+) -> FormToken:
+    profile = profile or active_profile()
+    page = _query_form_token(cookie, account, profile, transport or _transport)
+    return FormToken(_parse_form_token(page, profile))
+
+
+def _booking_payload(creds: SessionCredentials, profile: SiteProfile) -> dict:
+    year_field, month_field, day_field = profile.repeat_until_fields
     date_right_now = datetime.now()
-    payload = {
-        "form_token": creds.form_token,
-        "form_id": "room_reservations_reservation_node_form",
-        "reservation_length[und]": "180",  # 3 hours
-        "reservation_repeat_until[und][0][value][year]": date_right_now.year,
-        "reservation_repeat_until[und][0][value][month]": date_right_now.month,
-        "reservation_repeat_until[und][0][value][day]": date_right_now.day,
-        "op": "שמירה",  # "save" in hebrew
+    return {
+        profile.form_token_field: creds.form_token,
+        year_field: date_right_now.year,
+        month_field: date_right_now.month,
+        day_field: date_right_now.day,
+        **profile.booking_fields,
     }
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            url, headers=headers, cookies=creds.cookie, data=payload
-        ) as response:
-            return await response.text()
 
 
-def _parse_booking_confirmation_message(html: str, logger: logging.Logger) -> str:
+async def _request_book_meeting(
+    creds: SessionCredentials,
+    time: datetime,
+    room_id: str,
+    profile: SiteProfile,
+    priority: Priority,
+    sender: Optional[Transport],
+) -> str:
+    url = _reservation_url(profile, time, room_id)
+    payload = _booking_payload(creds, profile)
+    await governor.acquire_async(profile.host, creds.account, priority)
+    started = monotonic()
+    response = await (sender or _transport).post_async(
+        url, profile.headers, creds.cookie, payload
+    )
+    _report(profile, response, started)
+    return response.text
+
+
+def _parse_booking_confirmation_message(
+    html: str, logger: logging.Logger, profile: Optional[SiteProfile] = None
+) -> str:
+    profile = profile or active_profile()
     soup = BeautifulSoup(html, "html.parser")
-    if response_message := soup.find(
-        "div",
-        class_="alert-dismissible",
-    ):
-        return response_message.text
-    elif response_message := soup.find(
-        "div",
-        class_="messages error",
-    ):
-        return response_message.text
-    else:
-        logger.error(f"Booking response message not found in {soup}")
-        return ""
+    for selector in profile.messages:
+        if response_message := selector.select_one(soup):
+            return response_message.text
+    logger.error(f"Booking response message not found in {soup}")
+    return ""
 
 
-def _is_booking_successful(message: str) -> bool:
+def _is_booking_successful(message: str, profile: Optional[SiteProfile] = None) -> bool:
     """
     this is a successful message:
     '\n×\nהודעת סטטוס\nהזמנות חדרים - הזמנה שםפרטי שםמשפחה נוצר.'
     """
-    if "נוצר" in message:
-        return True
-    return False
+    profile = profile or active_profile()
+    return any(marker in message for marker in profile.success_markers)
 
 
 async def book_room(
-    creds: SessionCredentials, time: datetime, room_id: str, logger: logging.Logger
+    creds: SessionCredentials,
+    time: datetime,
+    room_id: str,
+    logger: logging.Logger,
+    profile: Optional[SiteProfile] = None,
+    priority: Priority = Priority.BURST,
+    sender: Optional[Transport] = None,
 ) -> bool:
+    """
+    sender is anything with post_async, the shared transport when not given
+    """
+    profile = profile or active_profile()
     logger.info(f"RoomBookingAttempted")
-    response = await _request_book_meeting(creds, time, room_id)
-    message = _parse_booking_confirmation_message(response, logger)
+    response = await _request_book_meeting(
+        creds, time, room_id, profile, priority, sender
+    )
+    message = _parse_booking_confirmation_message(response, logger, profile)
     logger.info(f"RoomBookingResponseMessage: {message}")
-    return _is_booking_successful(message)
-
-
-def query_session_creds(creds: Credentials) -> SessionCredentials:
-    cookie = log_in(creds)
-    form_token = query_form_token(cookie)
-    return SessionCredentials(cookie=cookie, form_token=form_token)
+    return _is_booking_successful(message, profile)
+
+
+def query_session_creds(
+    creds: Credentials,
+    profile: Optional[SiteProfile] = None,
+    transport: Optional[Transport] = None,
+) -> SessionCredentials:
+    profile = profile or active_profile()
+    account = account_key(creds.username)
+    cookie = log_in(creds, profile, transport)
+    form_token = query_form_token(cookie, account, profile, transport)
+    return SessionCredentials(cookie=cookie, form_token=form_token, account=account)
@@ -107,6 +107,13 @@ def test_parse_form_token():
     )
 
 
+def test_login_page_has_no_rooms():
+    login_page = (
+        '<form id="user-login"><input name="name" /><input name="pass" /></form>'
+    )
+    assert list(_parse_rooms(login_page, logger)) == []
+
+
 def test_empty_rooms():
     rooms = []
     queried_date = datetime(2024, 5, 25)